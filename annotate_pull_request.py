@@ -1,4 +1,7 @@
 import argparse
+import glob
+import multiprocessing
+import os
 import sys
 try:
     from gtr.util import UserError
@@ -7,7 +10,10 @@ except ImportError:
 import github_connection
 from comment import Comment, PositionalComment, CommentFormatter
 from comment import markdown_escape
+from comment import resolve_positions
+from comment import fingerprint_marker, remove_posted_comments
 import sarif_parser
+import sarif_input
 import github_sarif_state
 try:
     import gtr.util.debug as Debug
@@ -59,12 +65,13 @@ class AnnotateFormatter(CommentFormatter):
             rv = rv + '\n><sup>' + markdown_escape(text) + '</sup>\n'
 #        rv = rv + '\n><sup>' + markdown_escape(text) + '</sup>\n'
 #        rv = rv + '\n><sup>' + markdown_escape(comment.body) + '</sup>\n'
+        rv = rv + fingerprint_marker(comment) + '\n'
         return rv
 
     def to_github_api_comment(self, ranges, comment):
         return dict(body=comment.formatter.to_github_api_body_fragment(comment, True),
                     path=comment.path,
-                    position=ranges[comment.path][comment.line])
+                    position=comment.position)
 
 class LeadFormatter(CommentFormatter):
     def __init__(self, options):
@@ -76,15 +83,102 @@ class LeadFormatter(CommentFormatter):
     def to_github_api_comment(self, ranges, comment):
         return dict(body=comment.to_github_api_body_fragment(),
                     path=comment.path,
-                    position=ranges[comment.path][comment.line])
+                    position=comment.position)
 
-def get_comments(options, modified_ranges): # type: (argparse.Namespace, RangeSet) -> sequence[Comment]
-    f = options.sarif_file
+def import_sarif_file(options, modified_ranges, f, jobs=1): # type: (argparse.Namespace, RangeSet, str, int) -> tuple[sequence[Comment], int, int]
     print("****** Importing '{0}' *******".format(f))
     # Each imported file gets its own CodeSonar state   
-    state = github_sarif_state.GithubSarifState()
-    sarif_parser.process_sarif(f, state)
-    return state.comments
+    line_filter = None
+    if options.modified_lines_only:
+        line_filter = make_line_filter(modified_ranges)
+    state = github_sarif_state.GithubSarifState(make_path_filter(modified_ranges), line_filter,
+                                                options.prefix, options.windows_path)
+    sarif_parser.process_sarif(f, state, options.single_pass, options.json_backend, jobs, options.sarif_index)
+    return state.comments, state.filtered_results, state.filtered_lines
+
+# The arguments shared by the files imported in a worker process, set by
+# init_import_worker
+worker_args = None
+
+def init_import_worker(options, modified_ranges):
+    global worker_args
+    worker_args = (options, modified_ranges)
+
+def import_sarif_file_in_worker(f): # type: (str) -> tuple[sequence[Comment], int, int]
+    options, modified_ranges = worker_args
+    return import_sarif_file(options, modified_ranges, f)
+
+def get_jobs(options): # type: (argparse.Namespace) -> int
+    if options.jobs > 0:
+        return options.jobs
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+def get_sarif_files(patterns): # type: (list[str]) -> list[str]
+    '''Return the SARIF files named by patterns, each of which is a file,
+    a directory, whose *.sarif files (compressed or not) are taken, or a
+    glob pattern'''
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(f for suffix in ('',) + sarif_input.COMPRESSED_SUFFIXES
+                             for f in glob.glob(os.path.join(pattern, '*.sarif' + suffix)))
+        elif glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+        else:
+            matches = [pattern]
+        if not matches:
+            raise UserError('No SARIF files match %r' % pattern)
+        for f in matches:
+            if f not in files:
+                files.append(f)
+    return files
+
+def merge_comments(file_comments): # type: (list[list[Comment]]) -> tuple[list[Comment], int]
+    '''Return the comments of all files, without those with the
+    fingerprint of a comment of an earlier file, and the number of those.
+    Comments that are alike within a file are all kept, as they are when
+    there is only one file.'''
+    comments = []
+    duplicates = 0
+    seen = set()
+    for fcomments in file_comments:
+        fingerprints = []
+        for c in fcomments:
+            fingerprint = c.fingerprint()
+            if fingerprint in seen:
+                duplicates += 1
+            else:
+                comments.append(c)
+                fingerprints.append(fingerprint)
+        seen.update(fingerprints)
+    return comments, duplicates
+
+def get_comments(options, modified_ranges): # type: (argparse.Namespace, RangeSet) -> tuple[sequence[Comment], int, int, int]
+    '''Import the SARIF files of options, in parallel if there are several,
+    or in shards if there is one, and return the comments of all of them
+    without duplicates, the numbers of results filtered out by path and by
+    line, and the number of duplicates.'''
+    files = get_sarif_files(options.sarif_file)
+    normalize_prefix(options)
+    jobs = get_jobs(options)
+    if len(files) == 1:
+        imports = [import_sarif_file(options, modified_ranges, files[0], jobs)]
+    elif jobs > 1:
+        jobs = min(jobs, len(files))
+        print("Importing %d SARIF files with %d processes" % (len(files), jobs))
+        imports = sarif_parser.map_in_workers(import_sarif_file_in_worker, files, jobs,
+                                              (options, modified_ranges), init_import_worker)
+    else:
+        imports = [import_sarif_file(options, modified_ranges, f) for f in files]
+    filtered_results = sum(i[1] for i in imports)
+    filtered_lines = sum(i[2] for i in imports)
+    if len(imports) == 1:
+        return imports[0][0], filtered_results, filtered_lines, 0
+    comments, duplicates = merge_comments([i[0] for i in imports])
+    return comments, filtered_results, filtered_lines, duplicates
 
 '''
 def get_comments(options, modified_ranges): # type: (argparse.Namespace, RangeSet) -> sequence[Comment]
@@ -115,21 +209,28 @@ def get_comments(options, modified_ranges): # type: (argparse.Namespace, RangeSe
 '''            
 
 # SARIF files contain absolute paths. Github diff contain
-# paths relative to the root of the repo.
-def adjust_comment_paths(options, comments):
+# paths relative to the root of the repo. The SARIF paths are made
+# relative to the prefix as they are resolved, see
+# sarif_filenames.FileLocationResolver.
+def normalize_prefix(options):
     if options.prefix:
         if not options.prefix.startswith('file://'):
             options.prefix = 'file://' + options.prefix
         if not options.prefix.endswith('/'):
             options.prefix += '/'
-        prefix_len = len(options.prefix)
-        for c in comments:
-            if getattr(c, 'path', None) != None:
-                # just in case some funky path exists
-                if c.path.startswith(options.prefix):
-                    c.path = c.path[prefix_len:]
-                    if options.windows_path:
-                        c.path = c.path.lower()
+
+def make_path_filter(ranges): # type: (RangeSet) -> Callable[[str], bool]
+    '''Return a predicate that is true of the paths of the files modified
+    by the pull request.'''
+    return ranges.__contains__
+
+def make_line_filter(ranges): # type: (RangeSet) -> Callable[[str, int], bool]
+    '''Return a predicate that is true of a path and a line if the pull
+    request modified that line of the file.'''
+    def in_modified_lines(path, line):
+        line_map = ranges.get(path)
+        return line_map is not None and line in line_map
+    return in_modified_lines
 
 def filter_comments(options, ranges, comments):
     comments_len = len(comments)
@@ -140,22 +241,54 @@ def adjust_formatters(comments, formatter):
     for comment in comments:
         comment.formatter = formatter
 
-def cut_down_to_byte_size(options, comments, ranges):
+def get_comment_length(comment, ranges): # type: (Comment, dict[str, RangeSet]) -> int
+    if   (isinstance(comment, PositionalComment)
+          and comment.position is not None):
+        return len(comment.to_github_api_comment(ranges))
+    else:
+        return len(comment.to_github_api_body_fragment())
+
+def get_split_notes(redacted, num_reviews): # type: (int, int) -> str
+    '''Return what is added to the lead comment once the reviews are made'''
+    notes = '\n%d comments were redacted due to space constraints.\n' % redacted
+    if num_reviews > 1:
+        notes += 'The comments are split into %d reviews.\n' % num_reviews
+    return notes
+
+def make_continuation_lead(options, i, num_reviews): # type: (argparse.Namespace, int, int) -> Comment
+    '''Return the lead comment of review i (counting from 1) of num_reviews'''
+    return Comment('CodeSonar warnings in files modified by this pull request, review %d of %d.' % (i, num_reviews), 0, '', '', '', LeadFormatter(options))
+
+def split_into_reviews(options, comments, ranges): # type: (argparse.Namespace, list[Comment], dict[str, RangeSet]) -> tuple[list[list[Comment]], int]
+    '''Split comments, in order, into at most options.max_reviews reviews
+    (any number if it is 0) of about options.review_size bytes each.
+    Return the reviews and the number of comments that did not fit.
+
+    The first comment is the lead comment, to which get_split_notes is
+    added afterwards, and each later review gets a continuation lead
+    comment, so room is left for them.'''
+    # There cannot be more reviews, or redacted comments, than comments
+    most = int('9' * len(str(len(comments))))
+    first_size = options.review_size - len(get_split_notes(most, most))
+    size = options.review_size - get_comment_length(make_continuation_lead(options, most, most), ranges)
+    reviews = [[]]
     sum = 0
-    num_comments = len(comments)
+    redacted = 0
     for i in xrange(0, len(comments)):
-        comment_length = 0
-        if   (isinstance(comments[i], PositionalComment)
-              and comments[i].path in ranges
-              and comments[i].line in ranges[comments[i].path]):
-            comment_length = len(comments[i].to_github_api_comment(ranges))
-        else:
-            comment_length = len(comments[i].to_github_api_body_fragment())
-        if sum + comment_length > options.review_size:
-            num_comments = i
-            break
+        comment_length = get_comment_length(comments[i], ranges)
+        if sum + comment_length > (first_size if len(reviews) == 1 else size):
+            if len(reviews) == options.max_reviews:
+                redacted += len(comments) - i
+                break
+            if comment_length > size:
+                # Too big for any review
+                redacted += 1
+                continue
+            reviews.append([])
+            sum = 0
+        reviews[-1].append(comments[i])
         sum += comment_length
-    return num_comments
+    return reviews, redacted
 
 def sort_comments(options, comments):
     comments.sort()
@@ -167,6 +300,7 @@ def handle_hub_uris(options, comments):
                                     
 
 def main(argv): # type: (list[str]) -> int
+    repo = None
     try:
         Debug.make_python_warnings_show_stack_traces()
         options = parse_args(argv[1:])
@@ -183,25 +317,42 @@ def main(argv): # type: (list[str]) -> int
             modified_ranges = pr.get_modified_ranges()
             print modified_ranges
             
-            comments = get_comments(options, modified_ranges)
-
-            adjust_comment_paths(options, comments)
+            comments, removed, unmodified_lines, duplicates = get_comments(options, modified_ranges)
 
-            removed = filter_comments(options, modified_ranges, comments)
+            removed += filter_comments(options, modified_ranges, comments)
 
             adjust_formatters(comments, AnnotateFormatter(options))
 
             sort_comments(options, comments)
 
+            posted = 0
+            if options.incremental:
+                posted = remove_posted_comments(comments, pr.get_posted_fingerprints())
+                print("%d comments were posted in earlier reviews" % posted)
+
+            resolve_positions(comments, modified_ranges)
+
             comments.insert(0, Comment('CodeSonar has detected the following warnings in files modified by this pull request.\n%d comments were not in files in this pull request.' % removed, 0, '', '', '', LeadFormatter(options)))
+            if options.modified_lines_only:
+                comments[0].body += '\n%d comments were not on lines modified by this pull request.' % unmodified_lines
+            if options.incremental:
+                comments[0].body += '\n%d comments were posted in earlier reviews.' % posted
+            if duplicates:
+                comments[0].body += '\n%d comments were duplicates of others.' % duplicates
 
-            num_comments = cut_down_to_byte_size(options, comments, modified_ranges)
-            comments[0].body += '\n%d comments were redacted due to space constraints.\n' % (len(comments) - num_comments)
-            comments = comments[:num_comments]
+            reviews, redacted = split_into_reviews(options, comments, modified_ranges)
+            comments[0].body += get_split_notes(redacted, len(reviews))
+            for i in xrange(1, len(reviews)):
+                reviews[i].insert(0, make_continuation_lead(options, i + 1, len(reviews)))
 
-            pr.make_review(
-                modified_ranges,
-                comments)
+            if options.incremental and len(comments) == 1:
+                print("No new comments to post")
+            else:
+                num_reviews, num_comments = pr.make_reviews(
+                    modified_ranges,
+                    reviews,
+                    options.review_concurrency)
+                print("Posted %d reviews with %d comments on lines of the diff" % (num_reviews, num_comments))
         if options.dump_pr_to_file:
             import json
             with open(options.dump_pr_to_file, 'w') as f:
@@ -216,6 +367,9 @@ def main(argv): # type: (list[str]) -> int
     except Exception:
         Debug.print_exc('EXCEPTION')
         return 1
+    finally:
+        if repo is not None:
+            repo.rate_limiter.print_summary()
         
     
 def check_positive(value): # type: (str) -> int
@@ -224,6 +378,12 @@ def check_positive(value): # type: (str) -> int
          raise UserError("%s is an invalid positive int value" % value)
     return ivalue
 
+def check_non_negative(value): # type: (str) -> int
+    ivalue = int(value)
+    if ivalue < 0:
+         raise UserError("%s is an invalid non-negative int value" % value)
+    return ivalue
+
 def handle_prefix_style(v):
     if platform.system() == 'Windows':
         return v.lower() != 'posix'
@@ -236,7 +396,13 @@ def parse_args(argv):
     # requires repo
     parser.add_argument('-s', '--sarif-file', 
                         dest='sarif_file',
-                        help='the SARIF file to use to make comments')
+                        action='append',
+                        help='the SARIF file to use to make comments, which may be compressed with gzip, bzip2, xz or zstd; may be given more than once, and may be a directory, whose *.sarif files (and *.sarif.gz etc.) are used, or a glob pattern')
+    parser.add_argument('-j', '--jobs',
+                        dest='jobs',
+                        default=1,
+                        type=int,
+                        help='number of processes importing SARIF files at the same time, or parsing the results of a single SARIF file (unless --single-pass is given); 0 for one per CPU, default 1, which imports everything in this process')
     parser.add_argument('-p', '--pull-request', 
                         dest='pull_request',
                         type=check_positive,
@@ -258,9 +424,98 @@ def parse_args(argv):
                         default=74000,
                         type=check_positive,
                         help='approximate size of comments in review, default 74000')
+    parser.add_argument('--max-reviews',
+                        dest='max_reviews',
+                        default=1,
+                        type=check_non_negative,
+                        help='number of reviews, each of about --review-size, into which the comments may be split, default 1; 0 makes as many as needed so that no comment is redacted')
+    parser.add_argument('--review-concurrency',
+                        dest='review_concurrency',
+                        default=1,
+                        type=check_positive,
+                        help='number of reviews after the first that are submitted at the same time, default 1')
+    parser.add_argument('--incremental',
+                        dest='incremental',
+                        action='store_true',
+                        help='only post the comments that no earlier review of the pull request has; no review is made if there are none')
     parser.add_argument('--hosted-viewer-uri',
                         dest='hosted_viewer_uri',
                         help='uses argument instead of hostedViewerUri from SARIF file')
+    parser.add_argument('--single-pass',
+                        dest='single_pass',
+                        action='store_true',
+                        help='read the SARIF file once instead of twice, buffering results that precede the tables (tool, artifacts and originalUriBaseIds) of their run; if a run lacks one of them, all of its results are buffered until the end of the run, so this saves memory only when the tables come first')
+    parser.add_argument('--sarif-index',
+                        dest='sarif_index',
+                        action='store_true',
+                        help='keep the byte offsets of the runs, tables and results of each SARIF file in a sidecar file (the SARIF file name plus .index), and use them to read only the parts of the file each pass needs')
+    parser.add_argument('--json-backend',
+                        dest='json_backend',
+                        choices=['auto', 'ijson', 'gtr'],
+                        default='auto',
+                        help='the JSON parser used to read the SARIF file; auto uses ijson when it is installed')
+    parser.add_argument('--connect-timeout',
+                        dest='connect_timeout',
+                        default=10.0,
+                        type=float,
+                        help='seconds to wait for a connection to GitHub, default 10')
+    parser.add_argument('--read-timeout',
+                        dest='read_timeout',
+                        default=120.0,
+                        type=float,
+                        help='seconds to wait for data from GitHub, default 120')
+    parser.add_argument('--pool-size',
+                        dest='pool_size',
+                        default=4,
+                        type=check_positive,
+                        help='number of connections to GitHub kept open for reuse, default 4')
+    parser.add_argument('--max-retries',
+                        dest='max_retries',
+                        default=5,
+                        type=int,
+                        help='times a request that failed with a 502, 503, 504 or a secondary rate limit is retried, default 5')
+    parser.add_argument('--retry-backoff',
+                        dest='retry_backoff',
+                        default=1.0,
+                        type=float,
+                        help='seconds of the first backoff before a retry, doubled for each later retry, default 1')
+    parser.add_argument('--min-rate-limit-remaining',
+                        dest='min_rate_limit_remaining',
+                        default=50,
+                        type=int,
+                        help='rate limit points below which requests wait for the limit to be reset, default 50')
+    parser.add_argument('--max-rate-limit-wait',
+                        dest='max_rate_limit_wait',
+                        default=900.0,
+                        type=float,
+                        help='longest wait, in seconds, for a rate limit before giving up, default 900')
+    parser.add_argument('--schema-cache-dir',
+                        dest='schema_cache_dir',
+                        default='~/.cache/annotate_pull_request',
+                        help='directory in which the GitHub GraphQL schema is cached, default ~/.cache/annotate_pull_request')
+    parser.add_argument('--schema-cache-ttl',
+                        dest='schema_cache_ttl',
+                        default=86400,
+                        type=int,
+                        help='seconds for which a cached schema is used before it is fetched again, default 86400; 0 always fetches it')
+    parser.add_argument('--schema-validation',
+                        dest='schema_validation',
+                        choices=['startup', 'each', 'off'],
+                        default='startup',
+                        help='validate the GraphQL queries once at startup (the default), before each request, or not at all; off does not need the schema')
+    parser.add_argument('--ranges-cache-dir',
+                        dest='ranges_cache_dir',
+                        default='~/.cache/annotate_pull_request/ranges',
+                        help='directory in which the modified ranges of pull requests are cached, default ~/.cache/annotate_pull_request/ranges')
+    parser.add_argument('--ranges-cache-size',
+                        dest='ranges_cache_size',
+                        default=64 * 1024 * 1024,
+                        type=int,
+                        help='bytes the ranges cache may use before the least recently used entries are removed, default 64MB; 0 disables the cache')
+    parser.add_argument('--modified-lines-only',
+                        dest='modified_lines_only',
+                        action='store_true',
+                        help='only report warnings on lines modified by the pull request; others are just counted')
     parser.add_argument('--prefix-style', 
                         dest='windows_path',
                         type=handle_prefix_style,
@@ -0,0 +1,90 @@
+import argparse
+import sys
+import time
+
+import sarif_parser
+import github_sarif_state
+
+def uncached_dispatch_table(klass, parser):
+    '''Build the dispatch table of a handler for every instance, as each
+    handler built its own property handlers before they were shared'''
+    table = sarif_parser.DispatchTable(klass)
+    klass.declare(table, parser)
+    table.defaults = table.defaults.items()
+    return table
+
+class HandlerCounter(object):
+    '''Counts the handlers created, and the dicts allocated for them: the
+    __dict__ of a handler without __slots__, and the two dicts of each
+    dispatch table that is built'''
+    def __init__(self):
+        self.handlers = 0
+        self.dicts = 0
+        self.results = 0
+
+    def install(self):
+        handler_init = sarif_parser.Handler.__init__
+        get_table = sarif_parser.get_dispatch_table
+        counter = self
+        def counting_init(handler, parser):
+            counter.handlers += 1
+            if hasattr(handler, '__dict__'):
+                counter.dicts += 1
+            if isinstance(handler, sarif_parser.ResultHandler):
+                counter.results += 1
+            handler_init(handler, parser)
+        def counting_get_table(klass, parser):
+            counter.dicts += 2
+            return get_table(klass, parser)
+        sarif_parser.Handler.__init__ = counting_init
+        sarif_parser.get_dispatch_table = counting_get_table
+
+def bench(args, f):
+    state = github_sarif_state.GithubSarifState()
+    start = time.time()
+    sarif_parser.process_sarif(f, state, args.single_pass, args.json_backend)
+    return time.time() - start, len(state.comments)
+
+def main():
+    '''Time the import of SARIF files, or count the handlers and dicts it
+    allocates per result'''
+    parser = argparse.ArgumentParser(description='Benchmark the SARIF parser')
+    parser.add_argument('inputs', nargs='+',
+                        help='The names of the SARIF files')
+    parser.add_argument('-1', '--single-pass', action='store_true',
+                        dest='single_pass',
+                        help="Import each file in a single pass")
+    parser.add_argument('--json-backend', default='auto',
+                        dest='json_backend',
+                        help="The JSON parser to use: auto, ijson or gtr")
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help="The number of times each file is imported; the best time is reported")
+    parser.add_argument('--count', action='store_true',
+                        help="Count handlers and dicts per result instead of timing the import")
+    parser.add_argument('--uncached-tables', action='store_true',
+                        dest='uncached_tables',
+                        help="Build the dispatch table of every handler as it is created, for comparison")
+    args = parser.parse_args()
+
+    if args.uncached_tables:
+        sarif_parser.get_dispatch_table = uncached_dispatch_table
+    counter = None
+    if args.count:
+        counter = HandlerCounter()
+        counter.install()
+        args.repeat = 1
+    for f in args.inputs:
+        times = []
+        for i in range(args.repeat):
+            seconds, comments = bench(args, f)
+            times.append(seconds)
+        print("{0}: {1} comments, best of {2}: {3:.2f}s".format(f, comments, len(times), min(times)))
+        if counter is not None:
+            results = max(counter.results, 1)
+            print("{0}: {1} results, {2:.1f} handlers and {3:.1f} dicts per result".format(
+                f, counter.results, counter.handlers / float(results), counter.dicts / float(results)))
+            counter.handlers = counter.dicts = counter.results = 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
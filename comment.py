@@ -1,32 +1,47 @@
+import hashlib
+import re
 import string
 
+# Each comment posted carries its fingerprint in an HTML comment, which
+# GitHub does not show, so that later runs can tell what was posted.
+fingerprintRe = re.compile(r'<!-- annotate-pull-request ([0-9a-f]{40}) -->')
+
 def markdown_escape(x): # type: (str) -> str
     '''Escape any special characters in a markdown string.  This
     function likely is not perfect.  There are also github bugs that
     make escaping emojis like :100: impossible.'''
     return ''.join(['\\' + c if c in string.punctuation else c for c in x])
 
+def fingerprint_marker(comment): # type: (Comment) -> str
+    return '<!-- annotate-pull-request %s -->' % comment.fingerprint()
+
+def find_fingerprints(text): # type: (str) -> list[str]
+    '''Return the fingerprints of the comments posted in text'''
+    return fingerprintRe.findall(text or '')
+
 class CommentFormatter(object):
     def to_github_api_body_fragment(self, comment):
         if (isinstance(comment, PositionalComment)):
-            return '* [%s](%s)`: %s:%d:` %s' % (
+            return '* [%s](%s)`: %s:%d:` %s %s' % (
                 comment.url.replace('`', ''),
                 comment.url.replace('`', ''),
                 comment.path.replace('`', ''),
                 comment.line,
                 markdown_escape(comment.body),
+                fingerprint_marker(comment),
                 )
         else:
-            return '* [%s](%s)`:` %s' % (
+            return '* [%s](%s)`:` %s %s' % (
                 comment.url.replace('`', ''),
                 comment.url.replace('`', ''),
                 markdown_escape(comment.body),
+                fingerprint_marker(comment),
                 )
             
     def to_github_api_comment(self, ranges, comment):
         return dict(body=comment.to_github_api_body_fragment(),
                     path=comment.path,
-                    position=ranges[comment.path][comment.line])
+                    position=comment.position)
 
 class Comment(object):
     def __init__(self, body, rank, class_name, significance, url, formatter=CommentFormatter()): # type: (str) -> str
@@ -40,6 +55,16 @@ class Comment(object):
     def to_github_api_body_fragment(self): # type: () -> str
         return self.formatter.to_github_api_body_fragment(self);
 
+    def get_fingerprint_fields(self): # type: () -> list
+        return ['', 0, self.class_name, self.body]
+
+    def fingerprint(self): # type: () -> str
+        '''Return a digest of the file, line, rule and message of the
+        comment, which is the same for the same warning in every run'''
+        fields = [f.encode('utf-8') if isinstance(f, unicode) else str(f)
+                  for f in self.get_fingerprint_fields()]
+        return hashlib.sha1('\0'.join(fields)).hexdigest()
+
     def __repr__(self): # type: () -> str
         return '%s(%.2f, %r, %r, %r, %r)' % (type(self).__name__, self.rank, self.class_name, self.significance, self.url, self.body)
 
@@ -57,10 +82,16 @@ class PositionalComment(Comment):
         super(PositionalComment, self).__init__(body, rank, class_name, significance, url, formatter)
         self.path = path
         self.line = line
+        # The position of the line in the diff, if it is in the diff.
+        # This is set by resolve_positions.
+        self.position = None
 
     def to_github_api_comment(self, ranges): # type: (dict[str, RangeMap[int, TargetToGitHubLineMap[int, int]]]) -> dict[str, union[str, int]]
         return self.formatter.to_github_api_comment(ranges, self)
 
+    def get_fingerprint_fields(self): # type: () -> list
+        return [self.path, self.line, self.class_name, self.body]
+
     def __repr__(self): # type: () -> str
         return '%s(%.2f, %r, %r, %r, %r, %r, %r)' % (type(self).__name__, self.rank, self.class_name, self.significance, self.url, self.path, self.line, self.body)
 
@@ -72,3 +103,29 @@ class PositionalComment(Comment):
             return 1
         # Now compare both as PositionalComments
         return cmp(self.rank, other.rank) or cmp(self.path, other.path) or cmp(self.line, other.line) or cmp(self.body, other.body)
+
+def resolve_positions(comments, ranges): # type: (list[Comment], dict[str, TargetToGitHubLineMap]) -> None
+    '''Set the position of each PositionalComment in comments from ranges,
+    or to None if its line is not in the diff. The comments of each file
+    are looked up together, in order of line.'''
+    by_path = {}
+    for c in comments:
+        if isinstance(c, PositionalComment):
+            by_path.setdefault(c.path, []).append(c)
+    for path, path_comments in by_path.iteritems():
+        line_map = ranges.get(path)
+        if line_map is None:
+            for c in path_comments:
+                c.position = None
+            continue
+        path_comments.sort(key=lambda c: c.line)
+        positions = line_map.get_many([c.line for c in path_comments])
+        for c, position in zip(path_comments, positions):
+            c.position = position
+
+def remove_posted_comments(comments, fingerprints): # type: (list[Comment], set[str]) -> int
+    '''Remove the comments whose fingerprints are in fingerprints, and
+    return the number removed'''
+    comments_len = len(comments)
+    comments[:] = [c for c in comments if c.fingerprint() not in fingerprints]
+    return comments_len - len(comments)
@@ -0,0 +1,114 @@
+'''Streaming scanner for the unified diff of a pull request
+
+Only file headers, hunk headers and line counts are looked at, so the
+memory used does not depend on the size of the diff. For each file, the
+scanner produces the ranges of target lines that can be commented on, in
+the form taken by github_connection.TargetToGitHubLineMap:
+  (first target line, last target line + 1, (first target line, first position))
+A position is what GitHub uses to place a review comment: the index of a
+line in the file's part of the diff, where the line after the first hunk
+header is 1. Later hunk headers count as lines.
+'''
+
+import re
+
+hunkHeaderRe = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+def iter_lines(chunks):
+    '''Split an iterable of strings into lines, without their line endings'''
+    pending = ''
+    for chunk in chunks:
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+def header_filename(line):
+    # '--- a/name' or '+++ b/name', where the name may be followed by a tab
+    # and a timestamp
+    return line[4:].split('\t', 1)[0].rstrip('\r\n')
+
+def diff_path(source_file, target_file):
+    '''Return the path of a file in the diff, from its '---' and '+++' names'''
+    if source_file.startswith('a/') and (target_file.startswith('b/') or target_file == '/dev/null'):
+        return source_file[2:]
+    if target_file.startswith('b/') and source_file == '/dev/null':
+        return target_file[2:]
+    return source_file
+
+def scan_diff(lines):
+    '''Yield (path, ranges) for each file in the diff, given as an iterable
+    of lines with or without their line endings'''
+    source_file = None
+    # The file being read, or None between files
+    path = None
+    ranges = None
+    seen_hunk = False
+    position = 0
+    # The lines left to read in the current hunk
+    source_left = 0
+    target_left = 0
+    target_line = 0
+    # The first target line and position of the range being read, if any
+    run_target = None
+    run_position = None
+    for line in lines:
+        if source_left > 0 or target_left > 0:
+            position += 1
+            c = line[:1]
+            if c == ' ' or c == '+' or c == '' or c == '\r' or c == '\n':
+                if run_target is None:
+                    run_target = target_line
+                    run_position = position
+                target_line += 1
+                target_left -= 1
+                if c != '+':
+                    source_left -= 1
+            else:
+                # A removed line or a no-newline marker ends the range
+                if run_target is not None:
+                    ranges.append((run_target, target_line, (run_target, run_position)))
+                    run_target = None
+                if c == '-':
+                    source_left -= 1
+            if source_left <= 0 and target_left <= 0:
+                source_left = target_left = 0
+                if run_target is not None:
+                    ranges.append((run_target, target_line, (run_target, run_position)))
+                    run_target = None
+            continue
+        if line.startswith('--- '):
+            if path is not None:
+                yield path, ranges
+                path = None
+            source_file = header_filename(line)
+            continue
+        if line.startswith('+++ ') and path is None and source_file is not None:
+            path = diff_path(source_file, header_filename(line))
+            ranges = []
+            seen_hunk = False
+            position = 0
+            continue
+        if path is None:
+            continue
+        m = hunkHeaderRe.match(line)
+        if m is not None:
+            if seen_hunk:
+                position += 1
+            seen_hunk = True
+            source_left = 1 if m.group(2) is None else int(m.group(2))
+            target_line = int(m.group(3))
+            target_left = 1 if m.group(4) is None else int(m.group(4))
+            continue
+        if line.startswith('\\') or line.rstrip('\r\n') == '':
+            # A no-newline marker or an empty line after a hunk still
+            # takes up a position
+            position += 1
+            continue
+        # Anything else starts the header of the next file
+        yield path, ranges
+        path = None
+    if path is not None:
+        yield path, ranges
@@ -3,107 +3,241 @@ try:
 except ImportError:
     from tinygtr.util import UserError
 try:
-    from gtr.rangemap import RangeMap
+    from gtr.rangemap import OffsetRangeMap
 except ImportError:
-    from tinygtr.rangemap import RangeMap
+    from tinygtr.rangemap import OffsetRangeMap
 from gql import gql, Client
 from gql.transport.requests import RequestsHTTPTransport
+from graphql import parse, introspection_query, print_ast
+from graphql.execution import ExecutionResult
 try:
     import gtr
 except ImportError:
     import tinygtr
-import urllib2
-import unidiff
-# now we mess with the internals of unidiff...
-# Unidiff is very unicode-centric. However, github diffs
-# may not be unicode compatible (especially when the diff
-# contains multiple translation files).
-# as we don't use the content of the diff, only the names and
-# changes, we un-unicode unidiff here.
-# If we don't modify unidiff, non-UTF-8 compatible strings
-# can't be read. If we modify the reading to not use any encoding,
-# the strings can't be encoded on their way out.
-# The new_* functions here are essentially the undecorated versions
-# of the functions found in unidiff/patch.py anf should track those functions
-# in new versions of unidiff.
-unidiff.DEFAULT_ENCODING = 'string-escape'
-unidiff.make_str = lambda x: x.encode(unidiff.DEFAULT_ENCODING)
-def new_linestr(self):
-    return "%s%s" % (self.line_type, self.value)
-unidiff.patch.Line.__str__ = new_linestr
-def new_patchinfostr(self):
-    return ''.join(line for line in self)
-unidiff.patch.PatchInfo.__str__ = new_patchinfostr
-def new_hunkstr(self):
-    # section header is optional and thus we output it only if it's present
-    head = "@@ -%d,%d +%d,%d @@%s\n" % (
-        self.source_start, self.source_length,
-        self.target_start, self.target_length,
-        ' ' + self.section_header if self.section_header else '')
-    content = ''.join(line for line in self)
-    return head + content
-unidiff.patch.Hunk.__str__ = new_hunkstr
-def new_patchsetstr(self):
-    return ''.join(patched_file for patched_file in self)
-unidiff.PatchSet.__str__ = new_patchsetstr
-unidiff.unicode = str
-import ssl
+import requests
+import requests.adapters
+import diff_scanner
+import ranges_cache
+import rate_limit
 import comment
+import hashlib
+import json
+import os
+import time
+from multiprocessing.pool import ThreadPool
 
-class TargetToGitHubLineMap(RangeMap):
-    def __getitem__(self, x):
-        # x is a target line, but git wants a "diff line" so we
-        # need to translate between coordinate systems.
-        base_target_line, base_github_line = super(TargetToGitHubLineMap, self).__getitem__(x)
-        return base_github_line + x - base_target_line
+GITHUB_GRAPHQL_URL = 'https://api.github.com/graphql'
+DIFF_CHUNK_SIZE = 65536
+
+# The GraphQL documents used. They are validated against the schema once,
+# when the client is made, unless --schema-validation says otherwise.
+ADD_COMMENT_MUTATION = gql("""
+    mutation AddPullRequestComment($vars:AddCommentInput!) {
+      addComment(input: $vars) {
+        subject {
+          id
+        }
+      }
+    }
+    """)
+
+ADD_REVIEW_MUTATION = gql("""
+    mutation AddPullRequestReview($vars:AddPullRequestReviewInput!) {
+      addPullRequestReview(input: $vars) {
+        pullRequestReview {
+          id
+        }
+      }
+    }
+    """)
+
+PULL_REQUEST_DUMP_QUERY = gql("""
+    query PullRequestDump($number:Int!, $owner:String!, $name:String!) {
+      repository(owner:$owner, name:$name) {
+        pullRequest(number:$number) {
+          reviews(last:1){
+            nodes{
+              id,
+              author{login},
+              body,
+              comments(first:100){
+                pageInfo{
+                  hasNextPage,
+                  endCursor
+                }
+                nodes{
+                  body,
+                  path,
+                  position
+                }
+              }
+            }
+          }
+        }
+      }
+      rateLimit {
+        cost
+      }
+    }
+    """)
+
+# The reviews of a pull request, a page at a time, with the first page
+# of the comments of each
+PULL_REQUEST_REVIEWS_QUERY = gql("""
+    query PullRequestReviews($number:Int!, $owner:String!, $name:String!, $after:String) {
+      repository(owner:$owner, name:$name) {
+        pullRequest(number:$number) {
+          reviews(first:50, after:$after){
+            pageInfo{
+              hasNextPage,
+              endCursor
+            }
+            nodes{
+              id,
+              author{login},
+              body,
+              comments(first:100){
+                pageInfo{
+                  hasNextPage,
+                  endCursor
+                }
+                nodes{
+                  body,
+                  path,
+                  position
+                }
+              }
+            }
+          }
+        }
+      }
+      rateLimit {
+        cost
+      }
+    }
+    """)
+
+# The comments of a review after the first page
+REVIEW_COMMENTS_QUERY = gql("""
+    query ReviewComments($id:ID!, $after:String) {
+      node(id:$id) {
+        ... on PullRequestReview {
+          comments(first:100, after:$after){
+            pageInfo{
+              hasNextPage,
+              endCursor
+            }
+            nodes{
+              body,
+              path,
+              position
+            }
+          }
+        }
+      }
+      rateLimit {
+        cost
+      }
+    }
+    """)
+
+FIND_PULL_REQUEST_ID_QUERY = gql("""
+    query FindPullRequestID($prid:Int!, $owner:String!, $name:String!) {
+      repository(owner:$owner, name:$name) {
+        pullRequest(number:$prid) {
+          id,
+          baseRefOid,
+          headRefOid
+        }
+      }
+      rateLimit {
+        cost
+      }
+    }
+    """)
+
+QUERIES = [ADD_COMMENT_MUTATION, ADD_REVIEW_MUTATION, PULL_REQUEST_DUMP_QUERY, PULL_REQUEST_REVIEWS_QUERY,
+           REVIEW_COMMENTS_QUERY, FIND_PULL_REQUEST_ID_QUERY]
+
+class SessionHTTPTransport(RequestsHTTPTransport):
+    '''A gql transport that posts through a requests.Session, so that its
+    connections are pooled and reused along with the session's other
+    requests, and through a rate_limit.RateLimiter.'''
+    def __init__(self, session, rate_limiter, url, **kwargs):
+        super(SessionHTTPTransport, self).__init__(url, **kwargs)
+        self.session = session
+        self.rate_limiter = rate_limiter
+
+    def execute(self, document, variable_values=None, timeout=None):
+        payload = {
+            'query': print_ast(document),
+            'variables': variable_values or {},
+            }
+        data_key = 'json' if self.use_json else 'data'
+        post_args = {
+            'headers': self.headers,
+            'auth': self.auth,
+            'cookies': self.cookies,
+            'timeout': timeout or self.default_timeout,
+            data_key: payload,
+            }
+        response = self.rate_limiter.request('graphql', lambda: self.session.post(self.url, **post_args),
+                                             rate_limit.is_graphql_rate_limited)
+        response.raise_for_status()
+        result = response.json()
+        assert 'errors' in result or 'data' in result, 'Received non-compatible response "{}"'.format(result)
+        # Queries that ask for rateLimit { cost } report what they cost;
+        # others are counted as a point.
+        cost = 1
+        if isinstance(result.get('data'), dict) and isinstance(result['data'].get('rateLimit'), dict):
+            cost = result['data']['rateLimit'].get('cost', 1)
+        self.rate_limiter.spent(cost)
+        return ExecutionResult(
+            errors=result.get('errors'),
+            data=result.get('data')
+        )
+
+class TargetToGitHubLineMap(OffsetRangeMap):
+    # x is a target line, but git wants a "diff line" so we
+    # need to translate between coordinate systems. Within each range the
+    # two differ by a constant, which is the offset of the range.
+    def __init__(self, ranges):
+        super(TargetToGitHubLineMap, self).__init__(
+            [(lower, upper, base_github_line - base_target_line)
+             for lower, upper, (base_target_line, base_github_line) in ranges])
 
 
 class PullRequest(object):
-    def __init__(self, repo, number, prid):
+    def __init__(self, repo, number, prid, base_sha=None, head_sha=None):
         self.repo = repo
         self.number = number
         self.prid = prid
+        self.base_sha = base_sha
+        self.head_sha = head_sha
         self.options = repo.options
         self.client = repo.client
         
     def make_global_comment(self, prid, message): # type: (int, str) -> None
-        query = gql("""
-        mutation AddPullRequestComment($vars:AddCommentInput!) {
-          addComment(input: $vars) {
-            subject {
-              id
-            }
-          }
-        }
-        """)
         variables = dict(
             vars=dict(
                 subjectId=prid,
                 body=message,
                 ))
     
-        print(self.client.execute(query, variables))
+        print(self.client.execute(ADD_COMMENT_MUTATION, variables))
     
-    def make_review(self, ranges, comments): # type: (RangeSet, list[Comment]) -> None
+    def make_review(self, ranges, comments): # type: (RangeSet, list[Comment]) -> int
+        '''Submit comments as one review, and return the number of
+        comments placed on lines of the diff'''
         body = []
         comdicts = []
         for c in comments:
             if   (isinstance(c, comment.PositionalComment)
-                  and c.path in ranges
-                  and c.line in ranges[c.path]):
+                  and c.position is not None):
                 comdicts.append(c.to_github_api_comment(ranges))
             else:
                 body.append(c.to_github_api_body_fragment())
         
-        query = gql("""
-        mutation AddPullRequestReview($vars:AddPullRequestReviewInput!) {
-          addPullRequestReview(input: $vars) {
-            pullRequestReview {
-              id
-            }
-          }
-        }
-        """)
         variables = dict(
             vars=dict(
                 pullRequestId=self.prid,
@@ -115,49 +249,55 @@ class PullRequest(object):
         print variables
     
         print(self.client.execute(
-            query,
+            ADD_REVIEW_MUTATION,
             variables,
             ))
+        return len(comdicts)
+
+    def make_reviews(self, ranges, reviews, concurrency=1): # type: (RangeSet, list[list[Comment]], int) -> tuple[int, int]
+        '''Submit each list of comments in reviews as a review, and return
+        the number of reviews and of comments on lines of the diff posted.
+        The first review is submitted before the others, which are
+        submitted by up to concurrency threads.'''
+        num_reviews = 0
+        num_comments = 0
+        pool = None
+        try:
+            num_comments += self.make_review(ranges, reviews[0])
+            num_reviews += 1
+            if concurrency > 1 and len(reviews) > 2:
+                pool = ThreadPool(min(concurrency, len(reviews) - 1))
+                results = pool.imap_unordered(lambda review: self.make_review(ranges, review), reviews[1:])
+            else:
+                results = (self.make_review(ranges, review) for review in reviews[1:])
+            for n in results:
+                num_comments += n
+                num_reviews += 1
+        except Exception:
+            print("Posted %d of %d reviews before an error" % (num_reviews, len(reviews)))
+            raise
+        finally:
+            if pool is not None:
+                pool.terminate()
+        return num_reviews, num_comments
 
     def get_modified_ranges(self): # type: () -> dict[str, RangeSet]
+        cache = self.repo.ranges_cache
+        key = None
+        file_ranges = None
+        if cache is not None and self.base_sha and self.head_sha:
+            key = cache.make_key(self.options.repo_owner + '/' + self.options.repo_name,
+                                 self.base_sha, self.head_sha)
+            file_ranges = cache.get(key)
+            if file_ranges is not None:
+                print("Using the cached diff of %s...%s" % (self.base_sha, self.head_sha))
+        if file_ranges is None:
+            file_ranges = list(diff_scanner.scan_diff(self.get_diff()))
+            if key is not None:
+                cache.put(key, file_ranges)
         files = {}
-
-        http_stream = self.get_diff_via_urllib2()
-        for patch in unidiff.PatchSet.parse(
-              http_stream,
-              None):
-
-            ranges = []
-            hunk_base_position = 1
-            for hunk in patch:
-                last_github_pos = None
-                last_github_start = None
-                last_target = None
-                last_target_start = None
-                target_count = 0
-                for line in hunk.target_lines():
-                    # This is the position in the coordinate system that github uses.
-                    github_pos = hunk_base_position + line.diff_line_no - hunk[0].diff_line_no
-                    target_count += 1
-                    if last_github_pos is not None and last_github_pos + 1 != github_pos:
-                        ranges.append((last_target_start,
-                                       last_target + 1,
-                                       (last_target_start, last_github_start)))
-                    if last_github_pos is None or last_github_pos + 1 != github_pos:
-                        last_github_start = github_pos
-                        last_target_start = line.target_line_no
-                    last_github_pos = github_pos
-                    last_target = line.target_line_no
-                    assert last_github_start + line.target_line_no - last_target_start == github_pos
-                    # positions.append(pos)
-                if last_github_pos is not None:
-                    ranges.append((last_target_start,
-                                   last_target + 1,
-                                   (last_target_start, last_github_start)))
-                # I don't understand why the +1 is necessary, but
-                # positions are wrong without it.
-                hunk_base_position += len(hunk) + 1
-            files[patch.path] = TargetToGitHubLineMap(ranges)
+        for path, ranges in file_ranges:
+            files[path] = TargetToGitHubLineMap(ranges)
         return files
     
     def get_pull_request_url(self): # type: () -> str
@@ -168,12 +308,15 @@ class PullRequest(object):
                                                                 gtr.urlencode(self.options.repo_name),
                                                                 self.options.pull_request)
     
-    def get_diff_via_urllib2(self): # type: () -> stream
+    def get_diff(self): # type: () -> iterator[str]
+        '''Return the lines of the diff as they are received'''
         url = self.get_pull_request_url()
-        headers = {'Authorization':'token %s' % self.token,'Accept':'application/vnd.github.v3.diff'}
-        request = urllib2.Request(url, headers = headers)
-        context = ssl._create_unverified_context()
-        return urllib2.urlopen(request, context=context)
+        headers = {'Accept':'application/vnd.github.v3.diff'}
+        response = self.repo.rate_limiter.request('core', lambda: self.repo.session.get(
+            url, headers=headers, timeout=self.repo.timeout, stream=True))
+        response.raise_for_status()
+        self.repo.rate_limiter.spent(1)
+        return diff_scanner.iter_lines(response.iter_content(DIFF_CHUNK_SIZE))
 
     @property
     def token(self):
@@ -181,61 +324,82 @@ class PullRequest(object):
 
     # Useful for testing the github pull request integration
     def dump_last_review(self):
-        query = gql("""
-        query PullRequestDump($number:Int!, $owner:String!, $name:String!) {
-          repository(owner:$owner, name:$name) {
-            pullRequest(number:$number) {
-              reviews(last:1){
-                nodes{
-                  author{login},
-                  body,
-                  comments(first:100){
-                    nodes{
-                      body,
-                      path,
-                      position
-                    }
-                  }
-                }
-              }
-            }
-          }
-        }
-        """)
-
         variables = dict(
             number=self.number,
             owner=self.options.repo_owner,
             name=self.options.repo_name,
             )
-        response = self.client.execute(query, variables)
-        return response['repository']['pullRequest']['reviews']
+        response = self.client.execute(PULL_REQUEST_DUMP_QUERY, variables)
+        reviews = response['repository']['pullRequest']['reviews']
+        for review in reviews['nodes']:
+            self.complete_review(review)
+        return reviews
+
+    def complete_review(self, review): # type: (dict) -> None
+        '''Replace the first page of comments of review, a node from a
+        query, with all of its comments'''
+        comments = review['comments']
+        nodes = comments['nodes']
+        while comments['pageInfo']['hasNextPage']:
+            variables = dict(
+                id=review['id'],
+                after=comments['pageInfo']['endCursor'],
+                )
+            comments = self.client.execute(REVIEW_COMMENTS_QUERY, variables)['node']['comments']
+            nodes.extend(comments['nodes'])
+        review['comments'] = dict(nodes=nodes)
+        del review['id']
+
+    def get_reviews(self): # type: () -> iterator[dict]
+        '''Yield each review of the pull request with all of its comments'''
+        after = None
+        while True:
+            variables = dict(
+                number=self.number,
+                owner=self.options.repo_owner,
+                name=self.options.repo_name,
+                after=after,
+                )
+            response = self.client.execute(PULL_REQUEST_REVIEWS_QUERY, variables)
+            reviews = response['repository']['pullRequest']['reviews']
+            for review in reviews['nodes']:
+                self.complete_review(review)
+                yield review
+            if not reviews['pageInfo']['hasNextPage']:
+                return
+            after = reviews['pageInfo']['endCursor']
+
+    def get_posted_fingerprints(self): # type: () -> set[str]
+        '''Return the fingerprints of the comments in the reviews of the
+        pull request'''
+        fingerprints = set()
+        for review in self.get_reviews():
+            fingerprints.update(comment.find_fingerprints(review['body']))
+            for c in review['comments']['nodes']:
+                fingerprints.update(comment.find_fingerprints(c['body']))
+        return fingerprints
 
     
 
 class Repo(object):
     
-    def get_pr_id(self, user_facing_pr_id): # type: (int) -> int
-        query = gql("""
-        query FindPullRequestID($prid:Int!, $owner:String!, $name:String!) {
-          repository(owner:$owner, name:$name) {
-            pullRequest(number:$prid) {
-              id
-            }
-          }
-        }
-        """)
-
+    def get_pr_node(self, user_facing_pr_id): # type: (int) -> dict
+        '''Return the id and the base and head commits of a pull request'''
         variables = dict(
             prid=user_facing_pr_id,
             owner=self.options.repo_owner,
             name=self.options.repo_name,
             )
-        response = self.client.execute(query, variables)
-        return response['repository']['pullRequest']['id']
+        response = self.client.execute(FIND_PULL_REQUEST_ID_QUERY, variables)
+        return response['repository']['pullRequest']
+
+    def get_pr_id(self, user_facing_pr_id): # type: (int) -> int
+        return self.get_pr_node(user_facing_pr_id)['id']
 
     def get_pull_request(self, user_facing_pr_id): # type: (int) -> PullRequest
-        return PullRequest(self, user_facing_pr_id, self.get_pr_id(user_facing_pr_id))
+        node = self.get_pr_node(user_facing_pr_id)
+        return PullRequest(self, user_facing_pr_id, node['id'],
+                           node.get('baseRefOid'), node.get('headRefOid'))
     
     @property
     def token(self):
@@ -243,16 +407,73 @@ class Repo(object):
             raise UserError('Missing mandatory --token argument.  Visit https://github.com/settings/tokens/new to generate a token.')
         return self.options.token
     
+    def make_session(self): # type: () -> requests.Session
+        '''Make the session through which all requests to GitHub are made.
+        It keeps connections alive and accepts compressed responses.'''
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.options.pool_size)
+        session.mount('https://', adapter)
+        session.headers.update({
+            'Authorization': 'token %s' % self.token,
+            'Accept-Encoding': 'gzip, deflate',
+            })
+        return session
+
     def make_client(self): # type: () -> Client
-        _transport = RequestsHTTPTransport(
-            url='https://api.github.com/graphql',
+        _transport = SessionHTTPTransport(
+            self.session,
+            self.rate_limiter,
+            url=GITHUB_GRAPHQL_URL,
             use_json=True,
-            headers={'Authorization': 'token %s' % self.token},
+            timeout=self.timeout,
         )
-        return Client(
+        validation = self.options.schema_validation
+        introspection = None
+        if validation != 'off':
+            introspection = self.get_introspection(_transport, GITHUB_GRAPHQL_URL)
+        client = Client(
             transport=_transport,
-            fetch_schema_from_transport=True,
+            introspection=introspection,
         )
+        if validation == 'startup':
+            for query in QUERIES:
+                client.validate(query)
+            # Having been validated, the queries need not be validated again
+            # each time they are executed.
+            client.schema = None
+        return client
+
+    def get_schema_cache_file(self, url): # type: (str) -> str
+        return os.path.join(os.path.expanduser(self.options.schema_cache_dir),
+                            'schema-%s.json' % hashlib.sha1(url).hexdigest())
+
+    def get_introspection(self, transport, url): # type: (RequestsHTTPTransport, str) -> dict
+        '''Return the result of the introspection query for url, from the
+        schema cache if it has a copy younger than --schema-cache-ttl.'''
+        cache_file = self.get_schema_cache_file(url)
+        ttl = self.options.schema_cache_ttl
+        try:
+            if ttl > 0 and time.time() - os.path.getmtime(cache_file) < ttl:
+                with open(cache_file) as f:
+                    return json.load(f)
+        except (IOError, OSError, ValueError), e:
+            print("Ignoring schema cache file %s: %s" % (cache_file, e))
+        print("Fetching the GraphQL schema from %s" % url)
+        result = transport.execute(parse(introspection_query))
+        if result.errors:
+            raise UserError('Could not fetch the GraphQL schema: %s' % result.errors[0])
+        try:
+            cache_dir = os.path.dirname(cache_file)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            # Write and rename, so concurrent runs never see a partial file
+            tmp_file = '%s.%d' % (cache_file, os.getpid())
+            with open(tmp_file, 'w') as f:
+                json.dump(result.data, f)
+            os.rename(tmp_file, cache_file)
+        except (IOError, OSError), e:
+            print("Could not write schema cache file %s: %s" % (cache_file, e))
+        return result.data
     
     def split_repo(self): # type: () -> None
         repo = self.options.repo
@@ -276,4 +497,15 @@ class Repo(object):
             self.split_repo()
         else:
             raise UserError('Missing mandatory --repo flag')
+        # (connect, read) timeouts in seconds for every request
+        self.timeout = (options.connect_timeout, options.read_timeout)
+        self.session = self.make_session()
+        self.rate_limiter = rate_limit.RateLimiter(options.max_retries,
+                                                   options.retry_backoff,
+                                                   options.min_rate_limit_remaining,
+                                                   options.max_rate_limit_wait)
         self.client = self.make_client()
+        self.ranges_cache = None
+        if options.ranges_cache_size > 0:
+            self.ranges_cache = ranges_cache.RangesCache(options.ranges_cache_dir,
+                                                         options.ranges_cache_size)
@@ -1,25 +1,54 @@
 # The Github-specific SarifState
 
+from collections import namedtuple
+
 import sarif_filenames
 
 from sarif_state import SarifState
 from sarif_parser import sarif_assert
 from sarif_parser import unhandled_warning
-from sarif_parser import is_legacy_version
+from sarif_parser import collects_tables
+from sarif_parser import SINGLE_PASS
 
 from comment import Comment
 from comment import PositionalComment
 
 class GithubSarifState(SarifState):
-    def __init__(self):
+    def __init__(self, path_filter=None, line_filter=None, prefix=None, windows_path=False):
         super(GithubSarifState, self).__init__()
 
         self.comments = []
-
+        # Resolved paths that start with prefix are made relative to it
+        # (and lowercased, if windows_path), before any filtering.
+        self.prefix = prefix
+        self.windows_path = windows_path
+        # path_filter, if given, is a predicate on the resolved path of the
+        # location of a result. Results in paths for which it is false are
+        # only counted in filtered_results; no comment is made for them.
+        self.path_filter = path_filter
+        self.filtered_results = 0
+        # line_filter, if given, is a predicate on the path and the line at
+        # which the comment for a result would be made. Results that pass
+        # path_filter but not line_filter are counted in filtered_lines.
+        self.line_filter = line_filter
+        self.filtered_lines = 0
+
+        # The SarifRun of each run, from pass 1
+        self.runs = []
+        # In a shard of the results of a run, the shard's index and the
+        # warning class updates of its results (see replay_class_updates)
+        self.shard_run_index = None
+        self.class_updates = None
+        # The number of runs begun in the current pass
+        self.run_count = 0
         self.reset_for_run()
 
     def reset_for_run(self):
-        self.sarif_run = SarifRun()
+        self.sarif_run = SarifRun(self.prefix, self.windows_path, self.path_filter)
+        # In the single pass, results read before the tables of the run
+        # are complete wait here.
+        self.tables_complete = False
+        self.deferred_results = []
 
     def original_uri_base_id_add(self, uri, uriBaseId, key):
         self.sarif_run.originalUriBaseIdMap[key] = (uri, uriBaseId)
@@ -37,22 +66,90 @@ class GithubSarifState(SarifState):
         self.sarif_run.add_new_warning_class(rule)
 
     def run_object_member_end(self, tool_name, message_strings):
-        if self.ppass == 1:
+        if collects_tables(self.ppass):
             self.sarif_run.tool = tool_name
             self.sarif_run.messageStrings = message_strings
 
+    def set_ppass(self, ppass):
+        super(GithubSarifState, self).set_ppass(ppass)
+        self.run_count = 0
+
     def run_object_start(self, parser):
-        '''Clear out any state that might remain from a previous run'''
-        if self.ppass == 1:
+        '''Clear out any state that might remain from a previous run, or in
+        pass 2, select the tables of the run from pass 1'''
+        if collects_tables(self.ppass):
             self.reset_for_run()
-
-    def results_item_array_element_end(self, parser, idx):
+            self.runs.append(self.sarif_run)
+        elif self.run_count < len(self.runs):
+            self.sarif_run = self.runs[self.run_count]
+        self.run_count += 1
+
+    def run_tables_complete(self, parser):
+        self.tables_complete = True
+        self.report_deferred_results(parser)
+
+    def run_object_end(self, parser):
+        if self.deferred_results:
+            # A run need not have every table, and one that is missing can
+            # only be known not to follow the results at the end of the run.
+            print("*** {0} results were buffered to the end of their run, as it lacks some of its tables or has them after its results; an import in two passes buffers none".format(len(self.deferred_results)))
+        self.report_deferred_results(parser)
+
+    def results_item_array_element_end(self, parser, idx, result):
+        if self.ppass == SINGLE_PASS and not self.tables_complete:
+            self.deferred_results.append(result)
+            return
         # This is a good time to issue the warning
-        sarif_result_to_cso_warning(self, parser.version, parser.estack[-1])
+        sarif_result_to_cso_warning(self, parser.version, result)
+
+    def report_deferred_results(self, parser):
+        for result in self.deferred_results:
+            sarif_result_to_cso_warning(self, parser.version, result)
+        self.deferred_results = []
 
     def file_item_add(self, file_item):
         self.sarif_run.files.append(file_item)
 
+    def start_shard(self, run_index):
+        if run_index is None:
+            self.runs = []
+            self.class_updates = None
+        else:
+            self.sarif_run = self.runs[run_index]
+            self.class_updates = []
+        self.shard_run_index = run_index
+        self.comments = []
+        self.filtered_results = 0
+        self.filtered_lines = 0
+
+    def end_shard(self):
+        return (self.comments, self.filtered_results, self.filtered_lines,
+                self.shard_run_index, self.class_updates)
+
+    def merge_shard(self, output):
+        comments, filtered_results, filtered_lines, run_index, class_updates = output
+        if class_updates is not None:
+            self.replay_class_updates(self.runs[run_index], comments, class_updates)
+        self.comments.extend(comments)
+        self.filtered_results += filtered_results
+        self.filtered_lines += filtered_lines
+
+    def replay_class_updates(self, sarif_run, comments, class_updates):
+        '''A result can change its warning class for the results after it,
+        which a shard of the results cannot see. So the updates of a shard
+        are applied here, in the order of the file, to the warning classes
+        of sarif_run, and the rank and significance of each comment are
+        taken from its class as it is then, as in a parse in one process.'''
+        for i, (rule_index, rule_id, rank, update, comment_count) in enumerate(class_updates):
+            warning_class = find_warning_class(sarif_run, rule_index, rule_id, rank)
+            warning_class.apply_update(update)
+            # Each result makes at most one comment, after its update
+            next_count = class_updates[i + 1][4] if i + 1 < len(class_updates) else len(comments)
+            if next_count > comment_count:
+                comment = comments[comment_count]
+                comment.rank = warning_class.rank
+                comment.significance = warning_class.get_significancestring()
+
 class warning_significance(object):
     UNSPECIFIED = 0
     DIAGNOSTIC = 1
@@ -103,18 +200,18 @@ class WarningClass(object):
                                      rule.helpUri, rule.help, rule.messageStrings)
         return warning_class
 
-    def augment_warning_class_from_result(self, state, result):
+    def apply_update(self, update):
         '''Some Sarif producers put information about the warning class in with
         the result, instead of with the rule. This method allows us to add that
-        information before the actual CodeSonar warning class is created.
+        information, a WarningClassUpdate from get_warning_class_update, before
+        the actual CodeSonar warning class is created.
         '''
-        self.categories = augment_categories(result.properties, self.categories)
-        self.significance = extract_significance(result.properties,
-                                                 state.sarif_run.tool,
-                                                 self.significance)
-        sarif_rank = extract_rank(result.properties, state.sarif_run.tool, None)
-        if sarif_rank is not None:
-            self.rank = mk_rank(sarif_rank, None, result.level)
+        if update.category is not None and update.category not in self.categories:
+            self.categories.append(update.category)
+        if update.significance is not None:
+            self.significance = update.significance
+        if update.rank is not None:
+            self.rank = update.rank
 
     def get_messagestring(self, key, sarif_run):
         result = self.message_strings.get(key)
@@ -142,12 +239,26 @@ class WarningClass(object):
 class SarifRun(object):
     """Information specific to a single run is maintained here.
     """
-    def __init__(self):
+    def __init__(self, prefix=None, windows_path=False, path_filter=None):
         # originalUriBaseIdMap: a map of string to pairs of (uri, uriBaseId)
         # e.g: { 'SRCROOT': ('file:///C:/one/two/', None),
         #        'INC': ('include/', 'SRCROOT')}
         self.originalUriBaseIdMap = {}
+        self.prefix = prefix
+        self.windows_path = windows_path
+        self.path_filter = path_filter
+        # Created when the first location is resolved, after the
+        # originalUriBaseIds have been read.
+        self.resolver = None
         self.files = []
+        # The resolved path of each of self.files, or None if it has none.
+        # This is computed when it is first needed, since the
+        # originalUriBaseIds may follow the files in the SARIF file.
+        self.file_paths = None
+        # Resolved paths are interned through this map, and the result of
+        # path_filter for each of them is kept here.
+        self.paths = {}
+        self.path_flags = {}
         # Warning classes are stored in this array
         self.wcs = []
         # Maintain a map from ruleId to the index into self.wcs.
@@ -162,6 +273,37 @@ class SarifRun(object):
         self.wcs_map[warning_class.rule_id] = len(self.wcs)
         self.wcs.append(warning_class)
 
+    def resolve_file_location(self, uri, uriBaseId):
+        if self.resolver is None:
+            self.resolver = sarif_filenames.FileLocationResolver(
+                self.originalUriBaseIdMap, self.prefix, self.windows_path)
+        return self.resolver.resolve(uri, uriBaseId)
+
+    def resolve_files(self):
+        self.file_paths = []
+        for f in self.files:
+            fname = None
+            if f.uri is not None:
+                fname = self.resolve_file_location(f.uri, f.uriBaseId)
+            if fname is not None:
+                fname = self.paths.setdefault(fname, fname)
+                self.keep_path(fname)
+            self.file_paths.append(fname)
+
+    def file_path(self, fileIndex):
+        if self.file_paths is None:
+            self.resolve_files()
+        return self.file_paths[fileIndex]
+
+    def keep_path(self, fname):
+        '''Return True unless results in fname are filtered out'''
+        if self.path_filter is None:
+            return True
+        keep = self.path_flags.get(fname)
+        if keep is None:
+            keep = self.path_flags[fname] = bool(self.path_filter(fname))
+        return keep
+
 ##### GITHUB-SPECIFIC FUNCTIONS
 
 def codeflows_to_locations(cso, codeFlows):
@@ -269,6 +411,24 @@ def codesonar_significance(properties):
     }
     return sdict.get(csobag.get('significance'), warning_significance.RELIABILITY)
 
+# What a result changes in its warning class: a category to add, and a new
+# significance and rank, each of which is None if it is unchanged
+WarningClassUpdate = namedtuple('WarningClassUpdate', ['category', 'significance', 'rank'])
+
+def get_warning_class_update(state, result):
+    '''Return the WarningClassUpdate of result, without changing its class'''
+    properties = result.properties
+    if properties is None:
+        return WarningClassUpdate(None, None, None)
+    category = None
+    cwe = properties.get("CWEid")
+    if cwe is not None:
+        category = "CWE:{}".format(cwe)
+    significance = extract_significance(properties, state.sarif_run.tool, None)
+    sarif_rank = extract_rank(properties, state.sarif_run.tool, None)
+    rank = None if sarif_rank is None else mk_rank(sarif_rank, None, result.level)
+    return WarningClassUpdate(category, significance, rank)
+
 def augment_categories(properties, categories):
     """Extract a list of categories from a Sarif property bag
 
@@ -325,28 +485,36 @@ def sarif_result_to_cso_warning(state, version, result):
     codeFlows = result.codeFlows
     properties = result.properties
     hostedViewerUri = result.hostedViewerUri
-    if result.ruleIndex != -1:
-        warning_class = state.sarif_run.wcs[result.ruleIndex]
-    else:
-        # We have to create a new warning class. There's not much to go on here
-        # The warning class may already have been encountered, so look it up
-        # first.
-        ruleId = result.ruleId.encode('utf-8')
-        warning_class_index = state.sarif_run.wcs_map.get(ruleId)
-        if warning_class_index is not None:
-            # It's been encountered before. Use that.
-            warning_class = state.sarif_run.wcs[warning_class_index]
-        else:
-            # Create a new one and put it in the table with the run
-            warning_class = WarningClass(
-                ruleId,
-                ruleId,
-                mk_rank(result.rank, None, result.level),
-                [],
-                warning_significance.RELIABILITY)
-            state.sarif_run.add_warning_class(warning_class)
+    ruleId = None if result.ruleIndex != -1 else result.ruleId.encode('utf-8')
+    rank = mk_rank(result.rank, None, result.level)
+    warning_class = find_warning_class(state.sarif_run, result.ruleIndex, ruleId, rank)
+    update = get_warning_class_update(state, result)
+    warning_class.apply_update(update)
+    if state.class_updates is not None:
+        # In a shard of the results, the update is applied again when the
+        # shard is merged (see replay_class_updates)
+        state.class_updates.append((result.ruleIndex, ruleId, rank, update, len(state.comments)))
 
-    warning_class.augment_warning_class_from_result(state, result)
+    if len(locations) == 0:
+        unhandled_warning("locations list is empty")
+        return
+    if len(locations) > 1:
+        unhandled_warning("locations list is not a singleton; only the first location will be shown as the endbox in the CodeSonar warning")
+    coords = location_to_coords(state, version, locations[0])
+    if coords is None:
+        return
+    (endbox_sf, region) = coords
+    # Drop results in files we are not interested in before doing any more
+    # work on them. The warning class has been augmented already, so the
+    # ranks of the remaining results are unaffected.
+    if endbox_sf is not None and not state.sarif_run.keep_path(endbox_sf):
+        state.filtered_results += 1
+        return
+    if endbox_sf is not None and state.line_filter is not None:
+        line = 1 if region is None else region[0]
+        if not state.line_filter(endbox_sf, line):
+            state.filtered_lines += 1
+            return
 
     if result.message is not None:
         warning_message = result.message
@@ -359,15 +527,6 @@ def sarif_result_to_cso_warning(state, version, result):
 #    warning_message = warning_class.get_significancestring() + ': ' + warning_class.name + ': '+ warning_message
 
     message = to_reml(warning_message)
-    if len(locations) == 0:
-        unhandled_warning("locations list is empty")
-        return
-    if len(locations) > 1:
-        unhandled_warning("locations list is not a singleton; only the first location will be shown as the endbox in the CodeSonar warning")
-    coords = location_to_coords(state, version, locations[0])
-    if coords is None:
-        return
-    (endbox_sf, region) = coords
     # No source file at all? Report at project level
     if endbox_sf is None:
         addComment(state, Comment(message, warning_class.rank, warning_class.name, warning_class.get_significancestring(), hostedViewerUri))
@@ -398,8 +557,30 @@ def sarif_result_to_cso_warning(state, version, result):
 #        for x in extra_locations:
 #            addComment(cso, PositionalComment(x["message"], x["file"], x["region"][0]))
 
+def find_warning_class(sarif_run, rule_index, rule_id, rank):
+    '''Return the warning class of a result with rule_index, or if that is
+    -1, rule_id, creating it with rank if it is new'''
+    if rule_index != -1:
+        return sarif_run.wcs[rule_index]
+    # We have to create a new warning class. There's not much to go on here
+    # The warning class may already have been encountered, so look it up
+    # first.
+    warning_class_index = sarif_run.wcs_map.get(rule_id)
+    if warning_class_index is not None:
+        # It's been encountered before. Use that.
+        return sarif_run.wcs[warning_class_index]
+    # Create a new one and put it in the table with the run
+    warning_class = WarningClass(
+        rule_id,
+        rule_id,
+        rank,
+        [],
+        warning_significance.RELIABILITY)
+    sarif_run.add_warning_class(warning_class)
+    return warning_class
+
 def location_to_coords(state, version, location):
-    """Return a pair consisting of the sfile embedded within the LocationHandler instance, and the coordinates
+    """Return a pair consisting of the sfile embedded within the Location record, and the coordinates
     """
     if location.physicalLocation is None:
         unhandled_warning("location does not specify a physicalLocation")
@@ -408,19 +589,19 @@ def location_to_coords(state, version, location):
     if fileLoc is None:
         unhandled_warning("physicalLocation does not specify a fileLocation")
         return None
-    if is_legacy_version(version):
-        fileIndex = fileLoc.fileIndex
-    else:
-        fileIndex = fileLoc.index
+    fileIndex = fileLoc.index
+    fname = None
     if fileIndex != -1 and fileIndex is not None:
+        fname = state.sarif_run.file_path(fileIndex)
         fileLoc = state.sarif_run.files[fileIndex]
-    if fileLoc.uri is None:
-        unhandled_warning("fileLocation does not specify a uri")
-        return None
-    fname = sarif_filenames.resolve_file_location((fileLoc.uri, fileLoc.uriBaseId), state.sarif_run.originalUriBaseIdMap)
     if fname is None:
-        unhandled_warning("could not resolve file with uri '{}' and uriBaseId '{}'".format(fileLoc.uri, fileLoc.uriBaseId))
-        return None
+        if fileLoc.uri is None:
+            unhandled_warning("fileLocation does not specify a uri")
+            return None
+        fname = state.sarif_run.resolve_file_location(fileLoc.uri, fileLoc.uriBaseId)
+        if fname is None:
+            unhandled_warning("could not resolve file with uri '{}' and uriBaseId '{}'".format(fileLoc.uri, fileLoc.uriBaseId))
+            return None
     # Note that the normalization may not be able to normalize the file. In that case, just try the original name instead.
     # Although the file is unlikely to be found in a "real" program model, it might be in a mock one.
 #    fname = sarif_filenames.normalize_filename(fname, cso.sarif_state.original_dir, default=fname)
@@ -430,19 +611,21 @@ def location_to_coords(state, version, location):
     if region is None:
         return (fname, None)
     for fldname in ["charOffset", "charLength", "byteOffset", "byteLength"]:
-        if region.__dict__[fldname] is not None:
+        if getattr(region, fldname) is not None:
             unhandled_warning("region.{} is specified, but not currently handled".format(fldname))
     if region.startLine is None:
         unhandled_warning("region.startLine is not specified")
         return (fname, None)
     # Set the defaults according to the standard
-    if region.startColumn is None:
-        region.startColumn = 1
-    if region.endLine is None:
-        region.endLine = region.startLine
+    startColumn = region.startColumn
+    if startColumn is None:
+        startColumn = 1
+    endLine = region.endLine
+    if endLine is None:
+        endLine = region.startLine
     # The default is for region.endColumn is expected to be the last column on the given line,
     # but this is not possible to know unless we look at the file contents, which is odious.
-    return (fname, (region.startLine, region.endLine, region.startColumn, region.endColumn))
+    return (fname, (region.startLine, endLine, startColumn, region.endColumn))
 
 
 def mk_rank(rank, default_rank, level):
@@ -0,0 +1,121 @@
+'''JSON event parsers that can drive the SARIF parser
+
+A backend is a function (fobj, parser) that parses the JSON document in
+fobj and calls the AbstractJsonParser methods of parser in document order.
+It may return an object with a bytes_skipped attribute.
+
+The default is ijson's compiled yajl2_c backend when it is importable, and
+gtr (or tinygtr) otherwise. Both call the parser identically.
+'''
+
+try:
+    import gtr
+except ImportError:
+    import tinygtr as gtr
+
+try:
+    import ijson.backends.yajl2_c as ijson_yajl2_c
+    from ijson.common import JSONError as IjsonError
+except ImportError:
+    ijson_yajl2_c = None
+
+# The exceptions the backends raise for malformed JSON
+JSON_ERRORS = (ValueError,) if ijson_yajl2_c is None else (ValueError, IjsonError)
+
+# Returned from object_member_start or array_element_start to have the
+# value that follows skipped. It is gtr's own sentinel, so that gtr skips
+# the value too, or if gtr cannot skip, one that only ijson_stream_parse_all
+# recognizes. It is never None, which the other callbacks return.
+SKIP_VALUE = getattr(gtr, 'SKIP_VALUE', None)
+if SKIP_VALUE is None:
+    SKIP_VALUE = object()
+
+def ijson_stream_parse_all(fobj, parser):
+    '''Drive parser from the events of ijson.basic_parse
+
+    ijson has no notion of members or elements, so their start and end
+    callbacks are synthesized here. Values the parser asks to skip still
+    go through ijson, but without calling the parser.
+    '''
+    events = ijson_yajl2_c.basic_parse(fobj)
+    # One entry per open object or array: [is_object, key or index]
+    frames = []
+    for event, value in events:
+        if event == 'map_key':
+            frames[-1][1] = value
+            if parser.object_member_start(value) is not SKIP_VALUE:
+                continue
+            skip_ijson_value(events)
+        elif event == 'end_map':
+            frames.pop()
+            parser.object_end()
+        elif event == 'end_array':
+            frames.pop()
+            parser.array_end()
+        else:
+            if frames and not frames[-1][0]:
+                if parser.array_element_start(frames[-1][1]) is SKIP_VALUE:
+                    skip_ijson_value(events, event)
+                    event = None
+            if event == 'start_map':
+                parser.object_start()
+                frames.append([True, None])
+                continue
+            elif event == 'start_array':
+                parser.array_start()
+                frames.append([False, 0])
+                continue
+            elif event == 'string':
+                parser.string_value(value)
+            elif event == 'number':
+                if isinstance(value, (int, long)):
+                    parser.integer_value_as_string(str(value))
+                else:
+                    parser.float_value_as_string(str(value))
+            elif event == 'boolean':
+                if value:
+                    parser.true_value()
+                else:
+                    parser.false_value()
+            elif event == 'null':
+                parser.null_value()
+        # A value is complete
+        if frames:
+            frame = frames[-1]
+            if frame[0]:
+                parser.object_member_end(frame[1])
+            else:
+                parser.array_element_end(frame[1])
+                frame[1] += 1
+
+def skip_ijson_value(events, first=None):
+    '''Consume the events of one value, the first of which may already
+    have been read.'''
+    if first is None:
+        first, _ = next(events)
+    if first != 'start_map' and first != 'start_array':
+        return
+    depth = 1
+    for event, _ in events:
+        if event == 'start_map' or event == 'start_array':
+            depth += 1
+        elif event == 'end_map' or event == 'end_array':
+            depth -= 1
+            if depth == 0:
+                return
+
+BACKENDS = {
+    'gtr': gtr.json_stream_parse_all,
+    }
+if ijson_yajl2_c is not None:
+    BACKENDS['ijson'] = ijson_stream_parse_all
+
+def get_backend(name=None):
+    '''Return the backend with the given name, or the fastest available
+    one if name is None or "auto".'''
+    if name is None or name == 'auto':
+        name = 'ijson' if 'ijson' in BACKENDS else 'gtr'
+    backend = BACKENDS.get(name)
+    if backend is None:
+        raise ImportError("JSON backend '{0}' is not available".format(name))
+    return backend
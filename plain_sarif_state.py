@@ -43,7 +43,7 @@ class PlainSarifState(sarif_state.SarifState):
     def run_object_start(self, parser):
         print("executing SarifState.run_object_start")
 
-    def results_item_array_element_end(self, parser, idx):
+    def results_item_array_element_end(self, parser, idx, result):
         print("executing SarifState.results_item_array_element_end %d" % idx)
 
     def file_item_add(self, file_item):
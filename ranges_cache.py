@@ -0,0 +1,122 @@
+'''On-disk cache of the modified ranges of pull requests
+
+The ranges of the files of a diff, as produced by diff_scanner.scan_diff,
+are stored in one file per key. A key names the repository and the base
+and head commits of the pull request, so an entry never goes stale.
+
+Each file is zlib-compressed:
+  magic, then for each file of the diff:
+    path length and number of ranges (two little-endian uint32s), path,
+    then (lower, upper, first position) of each range as little-endian int32s
+The first target line of a range is its lower bound, so it is not stored.
+
+The cache is kept below a total size by removing the least recently used
+files. Using an entry updates its modification time.
+'''
+
+import array
+import hashlib
+import os
+import struct
+import sys
+import zlib
+
+MAGIC = 'APRR1\n'
+headerStruct = struct.Struct('<II')
+
+def dump_ranges(file_ranges): # type: (list[tuple[str, list]]) -> str
+    out = [MAGIC]
+    for path, ranges in file_ranges:
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        ints = array.array('i')
+        for lower, upper, (target_start, position) in ranges:
+            ints.extend((lower, upper, position))
+        if sys.byteorder != 'little':
+            ints.byteswap()
+        out.append(headerStruct.pack(len(path), len(ranges)))
+        out.append(path)
+        out.append(ints.tostring())
+    return zlib.compress(''.join(out))
+
+def load_ranges(data): # type: (str) -> list[tuple[str, list]]
+    data = zlib.decompress(data)
+    if not data.startswith(MAGIC):
+        raise ValueError('not a ranges cache file')
+    file_ranges = []
+    pos = len(MAGIC)
+    while pos < len(data):
+        path_len, nranges = headerStruct.unpack_from(data, pos)
+        pos += headerStruct.size
+        path = data[pos:pos + path_len]
+        pos += path_len
+        ints = array.array('i')
+        ints.fromstring(data[pos:pos + 3 * nranges * ints.itemsize])
+        pos += 3 * nranges * ints.itemsize
+        if sys.byteorder != 'little':
+            ints.byteswap()
+        ranges = [(ints[i], ints[i + 1], (ints[i], ints[i + 2])) for i in xrange(0, len(ints), 3)]
+        file_ranges.append((path, ranges))
+    return file_ranges
+
+class RangesCache(object):
+    def __init__(self, directory, max_size): # type: (str, int) -> None
+        self.directory = os.path.expanduser(directory)
+        self.max_size = max_size
+
+    def make_key(self, repo, base_sha, head_sha): # type: (str, str, str) -> str
+        return hashlib.sha1('%s %s %s' % (repo, base_sha, head_sha)).hexdigest()
+
+    def get_file(self, key):
+        return os.path.join(self.directory, 'ranges-%s.bin' % key)
+
+    def get(self, key): # type: (str) -> list[tuple[str, list]]
+        '''Return the ranges stored with key, or None'''
+        cache_file = self.get_file(key)
+        try:
+            with open(cache_file, 'rb') as f:
+                file_ranges = load_ranges(f.read())
+            os.utime(cache_file, None)
+            return file_ranges
+        except (IOError, OSError):
+            return None
+        except (ValueError, struct.error, zlib.error), e:
+            print("Ignoring ranges cache file %s: %s" % (cache_file, e))
+            return None
+
+    def put(self, key, file_ranges): # type: (str, list[tuple[str, list]]) -> None
+        cache_file = self.get_file(key)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Write and rename, so concurrent runs never see a partial file
+            tmp_file = '%s.%d' % (cache_file, os.getpid())
+            with open(tmp_file, 'wb') as f:
+                f.write(dump_ranges(file_ranges))
+            os.rename(tmp_file, cache_file)
+            self.evict()
+        except (IOError, OSError), e:
+            print("Could not write ranges cache file %s: %s" % (cache_file, e))
+
+    def evict(self):
+        '''Remove the least recently used files until the cache fits in max_size'''
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not (name.startswith('ranges-') and name.endswith('.bin')):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, name in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
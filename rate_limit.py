@@ -0,0 +1,147 @@
+'''Retries and rate limit bookkeeping for requests to GitHub
+
+GitHub keeps separate budgets of points for the REST API ('core') and for
+GraphQL ('graphql'), and reports what is left of the one a request used in
+its X-RateLimit-* headers. A RateLimiter sends every request, waits for
+the budget to be renewed when little of it is left, and retries requests
+that fail with a 502, 503 or 504, or with a secondary rate limit, after
+an exponential backoff with jitter. GraphQL may also report an exhausted
+limit in the errors of a 200 response, which is retried the same way.
+'''
+
+import random
+import threading
+import time
+try:
+    from gtr.util import UserError
+except ImportError:
+    from tinygtr.util import UserError
+
+RETRY_STATUSES = (502, 503, 504)
+
+def get_int_header(response, name): # type: (requests.Response, str) -> int
+    try:
+        return int(response.headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+def is_rate_limited(response): # type: (requests.Response) -> bool
+    '''Whether response is a refusal by a primary or secondary rate limit'''
+    if response.status_code not in (403, 429):
+        return False
+    if 'Retry-After' in response.headers or get_int_header(response, 'X-RateLimit-Remaining') == 0:
+        return True
+    try:
+        return 'rate limit' in response.text.lower()
+    except Exception:
+        return False
+
+def is_graphql_rate_limited(response): # type: (requests.Response) -> bool
+    '''Whether response, to a GraphQL request, is a refusal by a rate
+    limit, either as for REST or as an error of type RATE_LIMITED'''
+    if is_rate_limited(response):
+        return True
+    if response.status_code != 200 or 'RATE_LIMITED' not in response.text:
+        return False
+    try:
+        errors = response.json().get('errors')
+    except (ValueError, AttributeError):
+        return False
+    return isinstance(errors, list) and any(
+        isinstance(error, dict) and error.get('type') == 'RATE_LIMITED' for error in errors)
+
+class RateLimiter(object):
+    def __init__(self, max_retries=5, backoff=1.0, min_remaining=50, max_wait=900): # type: (int, float, int, float) -> None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.min_remaining = min_remaining
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        # resource -> (remaining, reset time), from the latest response
+        self.budgets = {}
+        self.requests = 0
+        self.retries = 0
+        self.cost = 0
+        self.waited = 0.0
+
+    def update(self, resource, response): # type: (str, requests.Response) -> None
+        remaining = get_int_header(response, 'X-RateLimit-Remaining')
+        reset = get_int_header(response, 'X-RateLimit-Reset')
+        resource = response.headers.get('X-RateLimit-Resource', resource)
+        if remaining is not None and reset is not None:
+            with self.lock:
+                self.budgets[resource] = (remaining, reset)
+
+    def spent(self, points): # type: (int) -> None
+        '''Count points of rate limit as used by a request'''
+        with self.lock:
+            self.cost += points
+
+    def wait(self, seconds, reason): # type: (float, str) -> None
+        if seconds > self.max_wait:
+            raise UserError('GitHub %s; giving up rather than waiting %d seconds' % (reason, seconds))
+        print("GitHub %s; waiting %.1f seconds" % (reason, seconds))
+        time.sleep(seconds)
+        with self.lock:
+            self.waited += seconds
+
+    def wait_for_budget(self, resource): # type: (str) -> None
+        '''Wait for the budget of resource to be renewed if less than
+        min_remaining points of it are left'''
+        with self.lock:
+            budget = self.budgets.get(resource)
+        if budget is None:
+            return
+        remaining, reset = budget
+        if remaining >= self.min_remaining:
+            return
+        seconds = reset - time.time() + 1
+        if seconds > 0:
+            self.wait(seconds, 'rate limit for %s has %d points left' % (resource, remaining))
+        with self.lock:
+            if self.budgets.get(resource) == budget:
+                del self.budgets[resource]
+
+    def get_retry_delay(self, response, attempt): # type: (requests.Response, int) -> float
+        retry_after = get_int_header(response, 'Retry-After')
+        if retry_after is not None:
+            return retry_after
+        if get_int_header(response, 'X-RateLimit-Remaining') == 0:
+            reset = get_int_header(response, 'X-RateLimit-Reset')
+            if reset is not None:
+                return max(reset - time.time() + 1, 0)
+        # Full jitter, so that runs sharing a token do not retry in step
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    def request(self, resource, send, rate_limited=is_rate_limited): # type: (str, Callable[[], requests.Response], Callable[[requests.Response], bool]) -> requests.Response
+        '''Return the response of send(), which makes a request that uses
+        the budget of resource, after retrying it as needed. rate_limited
+        tells whether a response is a refusal by a rate limit. The last
+        response is returned even if it is an error.'''
+        attempt = 0
+        while True:
+            self.wait_for_budget(resource)
+            response = send()
+            with self.lock:
+                self.requests += 1
+            self.update(resource, response)
+            if attempt >= self.max_retries:
+                return response
+            if response.status_code in RETRY_STATUSES:
+                reason = 'returned %d' % response.status_code
+            elif rate_limited(response):
+                reason = 'rate limit exceeded'
+            else:
+                return response
+            self.wait(self.get_retry_delay(response, attempt), reason)
+            response.close()
+            attempt += 1
+            with self.lock:
+                self.retries += 1
+
+    def print_summary(self): # type: () -> None
+        print("GitHub requests: %d (%d retries), rate limit points used: %d, seconds waiting: %.1f" % (
+            self.requests, self.retries, self.cost, self.waited))
+        for resource, (remaining, reset) in sorted(self.budgets.items()):
+            print("GitHub %s rate limit: %d points left until %s" % (
+                resource, remaining, time.strftime('%H:%M:%S', time.localtime(reset))))
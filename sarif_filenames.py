@@ -68,6 +68,65 @@ def resolve_uri_baseid(uriBaseId, originalUriBaseIdMap):
         # Step 7
         uriBaseId = fileLoc[1]
 
+def strip_prefix(fname, prefix, lowercase=False):
+    """Make fname relative to prefix, if it starts with it
+
+    The relative name is lowercased if lowercase is True, which is used for
+    Windows paths. Other names are returned as they are.
+    """
+    if prefix and fname.startswith(prefix):
+        fname = fname[len(prefix):]
+        if lowercase:
+            fname = fname.lower()
+    return fname
+
+class FileLocationResolver(object):
+    """Resolves the file locations of one run, with memoization
+
+    Every uriBaseId of the run is resolved to its absolute prefix once,
+    and each distinct (uri, uriBaseId) pair is resolved once, up to
+    cache_size of them. If prefix is given, resolved names are passed
+    through strip_prefix as well.
+    """
+    def __init__(self, originalUriBaseIdMap, prefix=None, lowercase=False, cache_size=65536):
+        self.originalUriBaseIdMap = originalUriBaseIdMap
+        self.prefix = prefix
+        self.lowercase = lowercase
+        self.cache_size = cache_size
+        self.bases = {}
+        for uriBaseId in originalUriBaseIdMap:
+            self.resolve_uri_baseid(uriBaseId)
+        self.cache = {}
+
+    def resolve_uri_baseid(self, uriBaseId):
+        # Unknown or cyclic uriBaseIds resolve to None, and are only reported once
+        try:
+            return self.bases[uriBaseId]
+        except KeyError:
+            resolution = self.bases[uriBaseId] = resolve_uri_baseid(uriBaseId, self.originalUriBaseIdMap)
+            return resolution
+
+    def resolve(self, uri, uriBaseId):
+        """Equivalent to resolve_file_location((uri, uriBaseId), originalUriBaseIdMap),
+        followed by strip_prefix if there is a prefix."""
+        key = (uri, uriBaseId)
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        if uriBaseId is None or uriIsAbsolute(uri):
+            fname = uri
+        else:
+            fname = self.resolve_uri_baseid(uriBaseId)
+            if fname is not None:
+                fname += uri
+        if fname is not None and self.prefix:
+            fname = strip_prefix(fname, self.prefix, self.lowercase)
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[key] = fname
+        return fname
+
 
 driveSpecRe = re.compile("^/([A-Z]):", re.IGNORECASE)
 def normalize_filename(fname, original_dir, default=None):
@@ -122,6 +181,20 @@ def test_resolution_and_normalization():
     check_resolve(('file:///c:/My Documents/', None), 'file:///c:/My Documents/')
     check_resolve(('buffers.c', 'BUFFERS'), 'file:///c:/browser/src/editor/buffers/buffers.c')
 
+    resolver = FileLocationResolver(originalUriBaseIdMap, 'file:///c:/browser/src/', True, cache_size=2)
+    def check_resolver(fileLoc, answer):
+        for i in range(2):
+            result = resolver.resolve(*fileLoc)
+            if result == answer:
+                print("RESOLVER OK: '{0}".format(answer))
+            else:
+                print("RESOLVER FAIL: got '{0}', expected '{1}'".format(result, answer))
+
+    check_resolver(('scratch/foo.c', 'TMPDIR'), 'FILE:///tmp/scratch/foo.c')
+    check_resolver(('ui/Window.cpp', 'EDITOR'), 'editor/ui/window.cpp')
+    check_resolver(('Buffers.c', 'BUFFERS'), 'editor/buffers/buffers.c')
+    check_resolver(('x.c', 'NOSUCHBASE'), None)
+
     def check_normalization(fileLoc, answer):
         fname = resolve_file_location(fileLoc, originalUriBaseIdMap)
         if fname is None:
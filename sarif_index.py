@@ -0,0 +1,208 @@
+'''Byte offsets of the runs and results of a SARIF file
+
+The index is found by a scan of the tokens that delimit JSON values,
+without decoding them, so it is much cheaper than a pass of the parser.
+It lets the results of a run be split into shards that are parsed
+separately (see sarif_parser.process_sarif). A shard is the bytes from
+the start of one element of a results array to the end of a later one,
+so '[' + shard + ']' is a JSON array of those results.
+
+The index can be kept in a sidecar file next to the SARIF file, so that
+later imports of the same file need not scan it again. The sidecar
+records the size, modification time and SHA-1 of the file, and is only
+used if they all still match. It is zlib-compressed JSON.
+'''
+
+import hashlib
+import json
+import os
+import re
+import zlib
+
+# A string, which is a key if it is followed by a colon (group 1), or an
+# opening (group 2) or closing (group 3) bracket
+tokenRe = re.compile(r'"(?:[^"\\]|\\.)*"\s*(:)?|([{[])|([]}])')
+
+# The properties of a run whose offsets are kept: those read in pass 1
+SECTIONS = ('tool', 'artifacts', 'files', 'resources', 'originalUriBaseIds')
+
+class RunIndex(object):
+    __slots__ = ('start', 'end', 'sections', 'results')
+    def __init__(self, start, end, sections, results): # type: (int, int, dict[str, tuple[int, int]], list[tuple[int, int]]) -> None
+        # The bytes of the run object
+        self.start = start
+        self.end = end
+        # The (start, end) of the value of each of SECTIONS in the run,
+        # and of the rules array of the tool
+        self.sections = sections
+        # The (start, end) of each element of its results array
+        self.results = results
+
+def key_of(token, colon): # type: (str, int) -> unicode
+    key = token[1:token.rindex('"', 0, colon)]
+    if '\\' in key:
+        key = json.loads('"' + key + '"')
+    return key
+
+def index_sarif(data): # type: (union[mmap.mmap, str]) -> list[RunIndex]
+    '''Return the index of each run in data, the contents of a SARIF file'''
+    runs = []
+    depth = 0
+    # The start of the open object or array at each depth, and the latest
+    # key of each open object
+    starts = [None] * 8
+    keys = [None] * 8
+    sections = None
+    results = None
+    for m in tokenRe.finditer(data):
+        token = m.lastindex
+        if token is None:
+            # A string value
+            continue
+        if token == 1:
+            # Only the keys on the paths to the sections and the results
+            # matter
+            if depth < 5 or (depth == 5 and keys[3] == 'tool'):
+                keys[depth] = key_of(m.group(0), m.start(1) - m.start())
+        elif token == 2:
+            depth += 1
+            if depth < 8:
+                starts[depth] = m.start()
+                keys[depth] = None
+            if depth == 3 and keys[1] == 'runs':
+                sections = {}
+                results = []
+        else:
+            if depth < 7 and keys[1] == 'runs':
+                if depth == 5:
+                    if keys[3] == 'results':
+                        results.append((starts[5], m.end()))
+                    elif keys[3] == 'resources' and keys[4] == 'rules':
+                        sections['rules'] = (starts[5], m.end())
+                elif depth == 4:
+                    if keys[3] in SECTIONS:
+                        sections[keys[3]] = (starts[4], m.end())
+                elif depth == 6:
+                    if keys[3] == 'tool' and keys[4] == 'driver' and keys[5] == 'rules':
+                        sections['rules'] = (starts[6], m.end())
+                elif depth == 3:
+                    runs.append(RunIndex(starts[3], m.end(), sections, results))
+            depth -= 1
+    return runs
+
+def make_shards(runs, num_shards): # type: (list[RunIndex], int) -> list[tuple[int, int, int]]
+    '''Split the results of runs into about num_shards shards of about
+    the same size. Return (run index, start, end) of each shard, in the
+    order of the file.'''
+    total = sum(r.results[-1][1] - r.results[0][0] for r in runs if r.results)
+    target = max(total // max(num_shards, 1), 1)
+    shards = []
+    for run_index, run in enumerate(runs):
+        shard_start = None
+        for start, end in run.results:
+            if shard_start is None:
+                shard_start = start
+            if end - shard_start >= target:
+                shards.append((run_index, shard_start, end))
+                shard_start = None
+        if shard_start is not None:
+            shards.append((run_index, shard_start, run.results[-1][1]))
+    return shards
+
+SIDECAR_SUFFIX = '.index'
+SIDECAR_FORMAT = 1
+HASH_CHUNK_SIZE = 1 << 20
+
+def get_file_key(sfile, data): # type: (str, union[mmap.mmap, str]) -> dict
+    '''Return what identifies the contents of sfile, mapped as data, for
+    its sidecar'''
+    st = os.stat(sfile)
+    digest = hashlib.sha1()
+    for offset in range(0, len(data), HASH_CHUNK_SIZE):
+        digest.update(buffer(data, offset, HASH_CHUNK_SIZE))
+    return dict(format=SIDECAR_FORMAT, size=st.st_size, mtime=st.st_mtime, sha1=digest.hexdigest())
+
+def dump_index(key, runs): # type: (dict, list[RunIndex]) -> str
+    doc = dict(key)
+    doc['runs'] = [dict(start=r.start, end=r.end, sections=r.sections,
+                        results=[offset for span in r.results for offset in span])
+                   for r in runs]
+    return zlib.compress(json.dumps(doc, separators=(',', ':')))
+
+def load_index(data, key): # type: (str, dict) -> list[RunIndex]
+    '''Return the runs in data, a sidecar, or None if it is not for key'''
+    doc = json.loads(zlib.decompress(data))
+    for name, value in key.items():
+        if doc.get(name) != value:
+            return None
+    runs = []
+    for r in doc['runs']:
+        sections = dict((str(name), tuple(span)) for name, span in r['sections'].items())
+        offsets = r['results']
+        runs.append(RunIndex(r['start'], r['end'], sections, zip(offsets[0::2], offsets[1::2])))
+    return runs
+
+def get_index(sfile, data, use_sidecar=False): # type: (str, union[mmap.mmap, str], bool) -> list[RunIndex]
+    '''Return the index of sfile, whose contents are data. If use_sidecar
+    is True, it comes from the sidecar of sfile if that is up to date, and
+    otherwise the sidecar is written.'''
+    if not use_sidecar:
+        return index_sarif(data)
+    key = get_file_key(sfile, data)
+    sidecar = sfile + SIDECAR_SUFFIX
+    try:
+        with open(sidecar, 'rb') as fp:
+            runs = load_index(fp.read(), key)
+        if runs is not None:
+            print("*** Using the index in {0}".format(sidecar))
+            return runs
+        print("*** The index in {0} is out of date".format(sidecar))
+    except (IOError, OSError):
+        pass
+    except (ValueError, KeyError, TypeError, zlib.error), e:
+        print("*** Ignoring the index in {0}: {1}".format(sidecar, e))
+    runs = index_sarif(data)
+    try:
+        # Write and rename, so concurrent imports never see a partial file
+        tmp_file = '%s.%d' % (sidecar, os.getpid())
+        with open(tmp_file, 'wb') as fp:
+            fp.write(dump_index(key, runs))
+        os.rename(tmp_file, sidecar)
+    except (IOError, OSError), e:
+        print("*** Could not write the index {0}: {1}".format(sidecar, e))
+    return runs
+
+class SpanReader(object):
+    '''A file-like object that reads a sequence of pieces, each of which is
+    a string or the (start, end) of a span of data, a map of the file,
+    without copying the spans out of data ahead of time'''
+    def __init__(self, data, pieces): # type: (union[mmap.mmap, str], list[union[str, tuple[int, int]]]) -> None
+        self.data = data
+        self.pieces = iter(pieces)
+        self.current = None
+        self.pos = 0
+        self.end = 0
+
+    def read(self, size=-1): # type: (int) -> str
+        out = []
+        while size < 0 or size > 0:
+            if self.current is None:
+                piece = next(self.pieces, None)
+                if piece is None:
+                    break
+                if isinstance(piece, str):
+                    self.current = piece
+                    self.pos, self.end = 0, len(piece)
+                else:
+                    if piece[1] > len(self.data):
+                        raise IOError('unexpected end of file')
+                    self.current = self.data
+                    self.pos, self.end = piece
+            n = self.end - self.pos if size < 0 else min(size, self.end - self.pos)
+            out.append(self.current[self.pos:self.pos + n])
+            self.pos += n
+            if size > 0:
+                size -= n
+            if self.pos == self.end:
+                self.current = None
+        return ''.join(out)
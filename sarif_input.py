@@ -0,0 +1,105 @@
+'''Reading SARIF files through a memory map
+
+A SARIF file is mapped read-only rather than read into a string, so the
+version sniff, both passes, the index scan and any worker processes all
+read the same pages of the page cache instead of each holding a copy of
+the bytes. A map supports the buffer interface, so regular expressions
+scan it in place, and only the slices that are actually decoded are
+copied out of it.
+
+A compressed SARIF file, recognized by its magic bytes, cannot be mapped.
+It is decompressed as a stream instead, once for each pass, so the
+uncompressed file is never held in memory or written to disk. gzip and
+bzip2 are always supported, xz if the lzma module (backports.lzma on
+Python 2) is available, and zstd if the zstandard module is.
+'''
+
+import bz2
+import contextlib
+import gzip
+import mmap
+import os
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    from gtr.util import UserError
+except ImportError:
+    from tinygtr.util import UserError
+
+# The magic bytes at the start of each kind of compressed file
+MAGICS = (
+    ('gzip', '\x1f\x8b'),
+    ('bzip2', 'BZh'),
+    ('xz', '\xfd7zXZ\x00'),
+    ('zstd', '\x28\xb5\x2f\xfd'),
+    )
+MAGIC_SIZE = max(len(magic) for name, magic in MAGICS)
+
+# The suffixes of the compressed SARIF files taken from a directory
+COMPRESSED_SUFFIXES = ('.gz', '.bz2', '.xz', '.zst')
+
+def get_compression(sfile): # type: (str) -> str
+    '''Return the name of the compression of sfile, or None if it is not
+    compressed'''
+    with open(sfile, 'rb') as fp:
+        head = fp.read(MAGIC_SIZE)
+    for name, magic in MAGICS:
+        if head.startswith(magic):
+            return name
+    return None
+
+def open_compressed(sfile, compression): # type: (str, str) -> file
+    '''Return a stream of the decompressed contents of sfile, which is
+    compressed with compression'''
+    if compression == 'gzip':
+        return gzip.GzipFile(sfile, 'rb')
+    if compression == 'bzip2':
+        return bz2.BZ2File(sfile, 'rb')
+    if compression == 'xz' and lzma is not None:
+        return lzma.LZMAFile(sfile, 'rb')
+    if compression == 'zstd' and zstandard is not None:
+        # The reader closes the file when it is closed
+        return zstandard.ZstdDecompressor().stream_reader(open(sfile, 'rb'), read_across_frames=True)
+    raise UserError('%s is compressed with %s, which needs the %s module' % (
+        sfile, compression, 'zstandard' if compression == 'zstd' else 'lzma'))
+
+@contextlib.contextmanager
+def map_sarif(sfile): # type: (str) -> Iterator[union[mmap.mmap, str]]
+    '''Map sfile for the duration of the with statement. An empty file,
+    which cannot be mapped, is the empty string instead.'''
+    with open(sfile, 'rb') as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            data = ''
+        else:
+            data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield data
+    finally:
+        if data:
+            data.close()
+
+class MappedFile(object):
+    '''A file-like object that reads data, a map or a string, from the
+    start. A tokenizer that can scan data in place may use mapping, which
+    is all of data, instead of calling read().'''
+    def __init__(self, data): # type: (union[mmap.mmap, str]) -> None
+        self.mapping = data
+        self.pos = 0
+
+    def read(self, size=-1): # type: (int) -> str
+        end = len(self.mapping) if size < 0 else min(self.pos + size, len(self.mapping))
+        data = self.mapping[self.pos:end]
+        self.pos = max(self.pos, end)
+        return data
+
+    def tell(self): # type: () -> int
+        return self.pos
@@ -1,9 +1,18 @@
 # The application agnostic version.
 # For now, assumes the gtr json parser...
 
+import json
+import multiprocessing
 import os
 import re
 import sys
+from collections import namedtuple
+from contextlib import closing
+
+import json_backends
+import sarif_index
+import sarif_input
+from json_backends import SKIP_VALUE
 
 # We'll still need the alternate parser at some time.
 try:
@@ -18,7 +27,9 @@ class SarifImporterException(Exception):
     '''Generic exception triggered when the SARIF is not what is expected
     '''
     def __init__(self, value):
-        super(SarifImporterException, self).__init__()
+        # Passing value on keeps it in args, so that the exception can be
+        # pickled back from a worker process (see map_in_workers)
+        super(SarifImporterException, self).__init__(value)
         self.parameter = value
     def __str__(self):
         return repr(self.parameter)
@@ -51,6 +62,21 @@ class SarifVersionExtractor(gtr.AbstractJsonParser):
             self.version = str
             raise SarifVersionDone()
 
+# Values of SarifState.ppass. Pass 1 collects the tables of each run, pass 2
+# reports the results. The single pass does both in one read of the file.
+SINGLE_PASS = 0
+
+def collects_tables(ppass):
+    return ppass == 1 or ppass == SINGLE_PASS
+
+def reports_results(ppass):
+    return ppass == 2 or ppass == SINGLE_PASS
+
+def pass_description(ppass):
+    if ppass == SINGLE_PASS:
+        return "Single parser pass"
+    return "Parser pass {0}".format(ppass)
+
 def check_support_for_version(version):
     '''Check that the version is one that is supported.
 
@@ -95,6 +121,12 @@ class SarifParser(gtr.AbstractJsonParser):
         check_support_for_version(version)
         self.version = version
         self.state = state
+        # The dispatch tables of the handler classes for this version and pass
+        self.dispatch_tables = {}
+        # SkipHandler has no state, so one instance serves every skipped value.
+        # Backends that support it skip the values of ignored properties
+        # without calling back for anything inside them (see SKIP_VALUE).
+        self.skip_handler = SkipHandler(self)
         self.estack = [SarifTopHandler(self, state)]
     def object_start(self):
         self.estack[-1].object_start(self)
@@ -103,6 +135,8 @@ class SarifParser(gtr.AbstractJsonParser):
     def object_member_start(self, key):
         h = self.estack[-1].object_member_start(self, key)
         self.estack.append(h)
+        if h is self.skip_handler:
+            return SKIP_VALUE
     def object_member_end(self, key):
         self.estack[-2].object_member_end(self, key)
         self.estack.pop()
@@ -115,6 +149,8 @@ class SarifParser(gtr.AbstractJsonParser):
     def array_element_start(self, idx):
         h = self.estack[-1].array_element_start(self, idx)
         self.estack.append(h)
+        if h is self.skip_handler:
+            return SKIP_VALUE
     def array_element_end(self, idx):
         self.estack[-2].array_element_end(self, idx)
         self.estack.pop()
@@ -127,6 +163,67 @@ class SarifParser(gtr.AbstractJsonParser):
     def __str__(self):
         return "<SarifParser {0}>".format(self.estack)
 
+##########################################################################################
+# Records
+# The results of the parse that outlive their handlers. The handler of each of
+# these objects is replaced by its record as soon as it is complete, so only
+# the records are retained, e.g. while results wait in the single pass.
+# Lists within records are tuples. A file location has the same fields in
+# all versions: its fileIndex (legacy) or index (latest) becomes index.
+Result = namedtuple('Result', ['ruleId', 'ruleIndex', 'level', 'message', 'messageId',
+                               'locations', 'relatedLocations', 'codeFlows',
+                               'properties', 'hostedViewerUri', 'rank'])
+Location = namedtuple('Location', ['physicalLocation', 'message', 'id', 'properties'])
+PhysicalLocation = namedtuple('PhysicalLocation', ['fileLocation', 'region'])
+FileLocation = namedtuple('FileLocation', ['uri', 'uriBaseId', 'index'])
+Region = namedtuple('Region', ['startLine', 'startColumn', 'endLine', 'endColumn',
+                               'charOffset', 'charLength', 'byteOffset', 'byteLength',
+                               'message'])
+CodeFlow = namedtuple('CodeFlow', ['message', 'threadFlows'])
+ThreadFlow = namedtuple('ThreadFlow', ['id', 'message', 'locations'])
+ThreadFlowLocation = namedtuple('ThreadFlowLocation', ['location', 'importance'])
+
+# Dispatch tables shared by every parser, keyed by (class, version, ppass)
+dispatch_tables = {}
+
+class DispatchTable(object):
+    '''The property handlers of a handler class for one SARIF version and
+    pass, together with the default values of the properties.
+
+    These are computed once by the declare() method of the class and shared
+    by all of its instances.
+    '''
+    def __init__(self, klass):
+        self.klass = klass
+        self.property_handlers = {}
+        self.defaults = {}
+    def set_property_handler(self, key, klass, default=None):
+        # Skipped properties never get a value, so they need no default.
+        self.property_handlers[key] = klass
+        if klass is SkipHandler:
+            self.defaults.pop(key, None)
+        else:
+            self.defaults[key] = default
+    def set_skip_handlers(self, keys):
+        for key in keys:
+            if key in self.property_handlers:
+                general_warning("property {0} of {1} already has a handler".format(key, self.klass.__name__))
+            self.set_property_handler(key, SkipHandler)
+    def set_properties_handler(self, keys, klass):
+        for key in keys:
+            self.set_property_handler(key, klass)
+
+def get_dispatch_table(klass, parser):
+    key = (klass, parser.version, parser.state.get_ppass())
+    table = dispatch_tables.get(key)
+    if table is None:
+        table = DispatchTable(klass)
+        klass.declare(table, parser)
+        table.defaults = table.defaults.items()
+        dispatch_tables[key] = table
+    parser.dispatch_tables[klass] = table
+    return table
+
 class Handler(object):
     '''Handlers are objects that are pushed and popped from the stack maintained
     when the JSON object is processed.
@@ -134,16 +231,32 @@ class Handler(object):
     For each action in the parser, there is a corresponding handler action.
     This actions in this class are the default actions. Subclasses should specialize
     these if necessary.
+
+    Handlers for the objects that occur once per result or more often
+    declare __slots__, which must name every attribute they set.
+
+    The handlers of objects that are retained also define record(), which
+    returns the immutable record of the completed object.
     '''
+    __slots__ = ('property_handlers',)
     def __init__(self, parser):
         '''Subclasses should NOT re-define __init__(). Instead, they should
-        define initialize()'''
-        self.property_handlers = {}
+        define declare() and initialize()'''
+        table = parser.dispatch_tables.get(type(self))
+        if table is None:
+            table = get_dispatch_table(type(self), parser)
+        self.property_handlers = table.property_handlers
+        for key, default in table.defaults:
+            setattr(self, key, default)
+        self.initialize(parser)
+    @classmethod
+    def declare(cls, table, parser):
+        '''Declare the handlers for the properties of this class of object.
+        This is called once for each version and pass.'''
         # All objects may have a properties bag. This causes them all to be skipped.
-        # The initialize() method of a subclass should override this if those properties
+        # The declare() method of a subclass should override this if those properties
         # are important.
-        self.set_property_handler("properties", SkipHandler)
-        self.initialize(parser)
+        table.set_property_handler("properties", SkipHandler)
     def initialize(self, parser):
         pass
     def object_start(self, parser):
@@ -159,11 +272,11 @@ class Handler(object):
             except AttributeError:
                 pass
     def array_start(self, parser):
-        return SkipHandler(parser)
+        return parser.skip_handler
     def array_end(self, parser):
         pass
     def array_element_start(self, parser, idx):
-        return SkipHandler(parser)
+        return parser.skip_handler
     def array_element_end(self, parser, idx):
         pass
     def do_string(self, parser, value):
@@ -177,31 +290,22 @@ class Handler(object):
     def parse_property(self, parser, key):
         if key not in self.property_handlers:
             self.syntax_error(parser, "With stack {0}, property '{1}' was not expected".format(parser.estack, key))
-        return self.property_handlers[key](parser)
-    def set_property_handler(self, key, klass, default=None):
-        # This method takes care of assigning a default value to what will be
-        # returned too. This is only done if the attribute is not already present.
-        try:
-            getattr(self, key)
-        except AttributeError:
-            setattr(self, key, default)
-        self.property_handlers[key] = klass
-    def set_skip_handlers(self, keys):
-        for key in keys:
-            if key in self.property_handlers:
-                general_warning("property {0} of {1} already has a handler".format(key, self))
-            self.set_property_handler(key, SkipHandler)
-    def set_properties_handler(self, keys, klass):
-        for key in keys:
-            self.set_property_handler(key, klass)
+        klass = self.property_handlers[key]
+        if klass is SkipHandler:
+            return parser.skip_handler
+        return klass(parser)
     def __repr__(self):
         return type(self).__name__
 
 class SkipHandler(Handler):
     '''SkipHandler causes the parser to ignore all subterms
+
+    The parser tells the JSON parser to skip the value outright when it can,
+    so this only sees the subterms when the JSON parser cannot skip.
     '''
+    __slots__ = ()
     def object_member_start(self, parser, key):
-        return SkipHandler(parser)
+        return parser.skip_handler
 
 class SarifTopHandler(Handler):
     '''This is the top-level object that will contain the state of the parse.
@@ -233,25 +337,29 @@ class SarifTopHandler(Handler):
     def __init__(self, parser, state):
         self.state = state
         super(SarifTopHandler, self).__init__(parser)
+    @classmethod
+    def declare(cls, table, parser):
+        super(SarifTopHandler, cls).declare(table, parser)
+        table.set_skip_handlers(['version', '$schema'])
+        table.set_property_handler('runs', RunsHandler)
+        #   if parser.version[0] == 1:
+        #       table.set_property_handler('rules', RulesHandlerv1)
+        if collects_tables(parser.state.get_ppass()):
+            table.set_property_handler('properties', PropertiesHandler)
     def initialize(self, parser):
         self.properties = {}
-        self.set_skip_handlers(['version', '$schema'])
-        self.set_property_handler('runs', RunsHandler)
-        #   if parser.version[0] == 1:
-        #       self.set_property_handler('rules', RulesHandlerv1)
-        if self.state.get_ppass() == 1:
-            self.set_property_handler('properties', PropertiesHandler)
     def object_member_end(self, parser, key):
-        if key == "properties" and self.state.get_ppass() == 1:
+        if key == "properties" and collects_tables(self.state.get_ppass()):
             self.properties = parser.estack[-1].value
     def object_start(self, parser):
-        print("*** Parser pass {0} is beginning".format(self.state.get_ppass()))
+        print("*** {0} is beginning".format(pass_description(self.state.get_ppass())))
     def object_end(self, parser):
-        print("*** Parser pass {0} is now complete".format(self.state.get_ppass()))
+        print("*** {0} is now complete".format(pass_description(self.state.get_ppass())))
 
 class PropertiesHandler(Handler):
     """This is for handling generic property bags
     """
+    __slots__ = ('value', 'cur_key')
     def initialize(self, parser):
         self.value = None
         self.cur_key = None
@@ -284,9 +392,11 @@ class OriginalUriBaseIdsHandler(Handler):
         parser.state.original_uri_base_id_add(parser.estack[-1].uri, parser.estack[-1].uriBaseId, key)
 
 class ResourcesHandler(Handler):
-    def initialize(self, parser):
-        self.set_property_handler("rules", RulesHandler)
-        self.set_property_handler("messageStrings", PropertiesHandler)
+    @classmethod
+    def declare(cls, table, parser):
+        super(ResourcesHandler, cls).declare(table, parser)
+        table.set_property_handler("rules", RulesHandler)
+        table.set_property_handler("messageStrings", PropertiesHandler)
     def object_member_end(self, parser, key):
         parser.state.resources_object_member_end(parser, key)
 
@@ -301,20 +411,22 @@ class RulesItemHandler(Handler):
         parser.state.rules_item_array_element_end(parser, idx)
 
 class RuleHandler(Handler):
+    @classmethod
+    def declare(cls, table, parser):
+        super(RuleHandler, cls).declare(table, parser)
+        table.set_property_handler("id", StringHandler)
+        table.set_property_handler("name", MessageHandler)
+        table.set_property_handler("shortDescription", MessageHandler)
+        table.set_property_handler("fullDescription", MessageHandler)
+        table.set_property_handler("messageStrings", PropertiesHandler)
+        table.set_skip_handlers(["richMessageStrings"])
+        table.set_property_handler("helpUri", StringHandler)
+        table.set_property_handler("help", MessageHandler)
+        table.set_property_handler("configuration", RuleConfigurationHandler)
+        table.set_property_handler("properties", PropertiesHandler)
     def initialize(self, parser):
         self.defaultLevel = None
         self.defaultRank = None
-        self.properties = None
-        self.set_property_handler("id", StringHandler)
-        self.set_property_handler("name", MessageHandler)
-        self.set_property_handler("shortDescription", MessageHandler)
-        self.set_property_handler("fullDescription", MessageHandler)
-        self.set_property_handler("messageStrings", PropertiesHandler)
-        self.set_skip_handlers(["richMessageStrings"])
-        self.set_property_handler("helpUri", StringHandler)
-        self.set_property_handler("help", MessageHandler)
-        self.set_property_handler("configuration", RuleConfigurationHandler)
-        self.set_property_handler("properties", PropertiesHandler)
     def object_member_end(self, parser, key):
         if key == "configuration":
             self.defaultLevel = parser.estack[-1].defaultLevel
@@ -325,10 +437,12 @@ class RuleHandler(Handler):
             super(RuleHandler, self).object_member_end(parser, key)
 
 class RuleConfigurationHandler(Handler):
-    def initialize(self, parser):
-        self.set_property_handler("defaultLevel", StringHandler)
-        self.set_property_handler("defaultRank", FloatHandler)
-        self.set_skip_handlers(["enabled", "parameters"])
+    @classmethod
+    def declare(cls, table, parser):
+        super(RuleConfigurationHandler, cls).declare(table, parser)
+        table.set_property_handler("defaultLevel", StringHandler)
+        table.set_property_handler("defaultRank", FloatHandler)
+        table.set_skip_handlers(["enabled", "parameters"])
 
 class ArtifactsHandler(Handler):
     def initialize(self, parser):
@@ -343,9 +457,11 @@ class ArtifactsItemHandler(Handler):
         parser.state.file_item_add(parser.estack[-1])
 
 class ArtifactHandler(Handler):
-    def initialize(self, parser):
-        self.set_property_handler("location", ArtifactLocationHandler)
-        self.set_skip_handlers(
+    @classmethod
+    def declare(cls, table, parser):
+        super(ArtifactHandler, cls).declare(table, parser)
+        table.set_property_handler("location", ArtifactLocationHandler)
+        table.set_skip_handlers(
             ["description", "parentIndex", "offset", "length", "roles", "mimeType",
              "contents", "encoding", "sourceLanguage", "hashes", "lastModifiedTimeUtc"])
     def object_member_end(self, parser, key):
@@ -356,16 +472,21 @@ class ArtifactHandler(Handler):
             super(ArtifactHandler, self).object_member_end(parser, key)
 
 class ArtifactLocationHandler(Handler):
-    def initialize(self, parser):
-        self.set_property_handler("uri", StringHandler)
-        self.set_property_handler("uriBaseId", StringHandler)
-        self.set_property_handler("index", IntegerHandler)
-        self.set_property_handler("description", MessageHandler)
+    __slots__ = ('uri', 'uriBaseId', 'index', 'description')
+    @classmethod
+    def declare(cls, table, parser):
+        super(ArtifactLocationHandler, cls).declare(table, parser)
+        table.set_property_handler("uri", StringHandler)
+        table.set_property_handler("uriBaseId", StringHandler)
+        table.set_property_handler("index", IntegerHandler)
+        table.set_property_handler("description", MessageHandler)
     def object_member_end(self, parser, key):
         if key == "uri":
             self.uri = gtr.urldecode(parser.estack[-1].value)
         else:
             super(ArtifactLocationHandler, self).object_member_end(parser, key)
+    def record(self):
+        return FileLocation(self.uri, self.uriBaseId, self.index)
 
 class RunsHandler(Handler):
     def initialize(self, parser):
@@ -378,62 +499,92 @@ class RunsItemHandler(Handler):
         return RunHandler(parser)
 
 class RunHandler(Handler):
-    def initialize(self, parser):
-        ppass = parser.estack[0].state.get_ppass()
+    # The properties of a run that must be read before its results can be
+    # reported.
+    legacy_tables = ["tool", "resources", "files", "originalUriBaseIds"]
+    tables = ["tool", "artifacts", "originalUriBaseIds"]
+    @classmethod
+    def declare(cls, table, parser):
+        super(RunHandler, cls).declare(table, parser)
+        ppass = parser.state.get_ppass()
         if is_legacy_version(parser.version):
-            if ppass == 1:
-                self.set_property_handler("files", FilesHandler)
-                self.set_property_handler("resources", ResourcesHandler)
-                self.set_property_handler("originalUriBaseIds", OriginalUriBaseIdsHandler)
-                self.set_property_handler("tool", ToolHandler)
-                self.set_skip_handlers(["results"])
-            if ppass == 2:
-                self.set_property_handler("results", ResultsHandler)
-                self.set_skip_handlers(["tool", "resources", "files", "originalUriBaseIds"])
+            if collects_tables(ppass):
+                table.set_property_handler("files", FilesHandler)
+                table.set_property_handler("resources", ResourcesHandler)
+                table.set_property_handler("originalUriBaseIds", OriginalUriBaseIdsHandler)
+                table.set_property_handler("tool", ToolHandler)
+            else:
+                table.set_skip_handlers(RunHandler.legacy_tables)
+            if reports_results(ppass):
+                table.set_property_handler("results", ResultsHandler)
+            else:
+                table.set_skip_handlers(["results"])
             # Skipped in all passes
-            self.set_skip_handlers(
+            table.set_skip_handlers(
                 ["id", "aggregateIds", "baselineInstanceGuid", "invocations", "conversion",
                  "versionControlProvenance", "logicalLocations", "graphs", "defaultFileEncoding",
                  "newlineSequences", "columnKind", "richMessageMimeType", "redactionToken"]
             )
         else:
-            if ppass == 1:
-                self.set_property_handler("tool", ToolHandler)
-                self.set_property_handler("artifacts", ArtifactsHandler)
-                self.set_property_handler("originalUriBaseIds", OriginalUriBaseIdsHandler)
-                self.set_skip_handlers(["results"])
-            if ppass == 2:
-                self.set_property_handler("results", ResultsHandler)
-                self.set_skip_handlers(["artifacts", "tool", "originalUriBaseIds"])
-            self.set_skip_handlers(
+            if collects_tables(ppass):
+                table.set_property_handler("tool", ToolHandler)
+                table.set_property_handler("artifacts", ArtifactsHandler)
+                table.set_property_handler("originalUriBaseIds", OriginalUriBaseIdsHandler)
+            else:
+                table.set_skip_handlers(RunHandler.tables)
+            if reports_results(ppass):
+                table.set_property_handler("results", ResultsHandler)
+            else:
+                table.set_skip_handlers(["results"])
+            table.set_skip_handlers(
                 ["invocations", "conversion", "language", "versionControlProvenance",
                  "logicalLocations", "graphs", "automationDetails", "runAggregates",
                  "baselineGuid", "redactionTokens", "defaultEncoding", "defaultSourceLanguage",
                  "newlineSequences", "columnKind", "externalPropertyFileReferences",
                  "threadFlowLocations", "taxonomies", "addresses", "translations", "policies",
                  "webRequests", "webResponses", "specialLocations"])
+    def initialize(self, parser):
+        # In the single pass, results that appear before all of the tables
+        # are buffered by the state until it is told they are complete.
+        self.pending_tables = set()
+        if parser.state.get_ppass() == SINGLE_PASS:
+            if is_legacy_version(parser.version):
+                self.pending_tables.update(RunHandler.legacy_tables)
+            else:
+                self.pending_tables.update(RunHandler.tables)
 
     def object_member_end(self, parser, key):
         ppass = parser.estack[0].state.get_ppass()
-        if ppass == 1:
+        if collects_tables(ppass):
             if key == "tool":
                 parser.state.run_object_member_end(parser.estack[-1].name, parser.estack[-1].globalMessageStrings)
+        if key in self.pending_tables:
+            self.pending_tables.remove(key)
+            if not self.pending_tables:
+                parser.state.run_tables_complete(parser)
     def object_start(self, parser):
         parser.state.run_object_start(parser)
+    def object_end(self, parser):
+        parser.state.run_object_end(parser)
 
 class ToolHandler(Handler):
-    def initialize(self, parser):
+    @classmethod
+    def declare(cls, table, parser):
+        super(ToolHandler, cls).declare(table, parser)
         if is_legacy_version(parser.version):
-            self.globalMessageStrings = {}
-            self.set_property_handler("name", StringHandler)
-            self.set_skip_handlers(
+            table.set_property_handler("name", StringHandler)
+            table.set_skip_handlers(
                 ["fullName", "semanticVersion", "version", "fileVersion",
                  "downloadUri", "language", "resourceLocation", "sarifLoggerVersion"]
             )
+        else:
+            table.set_property_handler("driver", ToolComponentHandler)
+            table.set_skip_handlers(["extensions"])
+    def initialize(self, parser):
+        if is_legacy_version(parser.version):
+            self.globalMessageStrings = {}
         else:
             self.name = None
-            self.set_property_handler("driver", ToolComponentHandler)
-            self.set_skip_handlers(["extensions"])
     def object_member_end(self, parser, key):
         if not is_legacy_version(parser.version) and key == "driver":
             self.name = parser.estack[-1].name
@@ -442,14 +593,16 @@ class ToolHandler(Handler):
             super(ToolHandler, self).object_member_end(parser, key)
 
 class ToolComponentHandler(Handler):
-    def initialize(self, parser):
-        self.set_property_handler("name", StringHandler)
-        self.set_property_handler("globalMessageStrings", PropertiesHandler)
+    @classmethod
+    def declare(cls, table, parser):
+        super(ToolComponentHandler, cls).declare(table, parser)
+        table.set_property_handler("name", StringHandler)
+        table.set_property_handler("globalMessageStrings", PropertiesHandler)
         if is_legacy_version(parser.version):
-            self.set_property_handler("rules", RulesHandler)
+            table.set_property_handler("rules", RulesHandler)
         else:
-            self.set_property_handler("rules", ReportingDescriptorsHandler)
-        self.set_skip_handlers(
+            table.set_property_handler("rules", ReportingDescriptorsHandler)
+        table.set_skip_handlers(
             ["guid", "organization", "product", "productSuite", "shortDescription", "fullDescription",
              "fullName", "version", "semanticVersion", "dottedQuadFileVersion", "releaseDateUtc", "downloadUri",
              "informationUri", "notifications", "taxa", "locations", "language",
@@ -470,22 +623,24 @@ class ReportingDescriptorsItemHandler(Handler):
         parser.state.rules_item_array_element_end(parser, idx)
 
 class ReportingDescriptorHandler(Handler):
+    @classmethod
+    def declare(cls, table, parser):
+        super(ReportingDescriptorHandler, cls).declare(table, parser)
+        table.set_property_handler("id", StringHandler)
+        table.set_property_handler("name", StringHandler)
+        table.set_property_handler("shortDescription", MessageHandler)
+        table.set_property_handler("fullDescription", MessageHandler)
+        table.set_property_handler("messageStrings", PropertiesHandler)
+        table.set_property_handler("helpUri", StringHandler)
+        table.set_property_handler("help", MessageHandler)
+        table.set_property_handler("defaultConfiguration", ReportingConfigurationHandler)
+        table.set_property_handler("properties", PropertiesHandler)
+        table.set_skip_handlers(
+            ["richMessageStrings", "deprecatedIds", "guid", "deprecatedNames", "relationships"]
+        )
     def initialize(self, parser):
         self.level = "warning"
         self.rank = -1
-        self.properties = None
-        self.set_property_handler("id", StringHandler)
-        self.set_property_handler("name", StringHandler)
-        self.set_property_handler("shortDescription", MessageHandler)
-        self.set_property_handler("fullDescription", MessageHandler)
-        self.set_property_handler("messageStrings", PropertiesHandler)
-        self.set_property_handler("helpUri", StringHandler)
-        self.set_property_handler("help", MessageHandler)
-        self.set_property_handler("defaultConfiguration", ReportingConfigurationHandler)
-        self.set_property_handler("properties", PropertiesHandler)
-        self.set_skip_handlers(
-            ["richMessageStrings", "deprecatedIds", "guid", "deprecatedNames", "relationships"]
-        )
     def object_member_end(self, parser, key):
         if key == "defaultConfiguration":
             self.level = parser.estack[-1].level
@@ -496,10 +651,12 @@ class ReportingDescriptorHandler(Handler):
             super(ReportingDescriptorHandler, self).object_member_end(parser, key)
 
 class ReportingConfigurationHandler(Handler):
-    def initialize(self, parser):
-        self.set_property_handler("level", StringHandler)
-        self.set_property_handler("rank", FloatHandler)
-        self.set_skip_handlers(["enabled", "parameters"])
+    @classmethod
+    def declare(cls, table, parser):
+        super(ReportingConfigurationHandler, cls).declare(table, parser)
+        table.set_property_handler("level", StringHandler)
+        table.set_property_handler("rank", FloatHandler)
+        table.set_skip_handlers(["enabled", "parameters"])
 
 class ResultsHandler(Handler):
     def initialize(self, parser):
@@ -511,41 +668,43 @@ class ResultsItemHandler(Handler):
     def array_element_start(self, parser, idx):
         return ResultHandler(parser)
     def array_element_end(self, parser, idx):
-        parser.state.results_item_array_element_end(parser, idx)
+        parser.state.results_item_array_element_end(parser, idx, parser.estack[-1].record())
 
 class ResultHandler(Handler):
-    def initialize(self, parser):
-        self.message = None
-        self.messageId = None
-        self.locations = []
-        self.relatedLocations = []
-        self.codeFlows = []
-        self.properties = None
-        self.set_property_handler("ruleId", StringHandler)
-        self.set_property_handler("ruleIndex", IntegerHandler, -1)
-        self.set_property_handler("level", StringHandler)
-        self.set_property_handler("message", MessageHandler)
-        self.set_property_handler("locations", LocationsHandler)
-        self.set_property_handler("relatedLocations", LocationsHandler)
-        self.set_property_handler("codeFlows", CodeFlowsHandler)
-        self.set_property_handler("properties", PropertiesHandler)
-        self.set_property_handler("hostedViewerUri", StringHandler)
-        self.set_property_handler("rank", FloatHandler)
+    __slots__ = ('ruleId', 'ruleIndex', 'level', 'message', 'messageId', 'locations',
+                 'relatedLocations', 'codeFlows', 'properties', 'hostedViewerUri', 'rank')
+    @classmethod
+    def declare(cls, table, parser):
+        super(ResultHandler, cls).declare(table, parser)
+        table.set_property_handler("ruleId", StringHandler)
+        table.set_property_handler("ruleIndex", IntegerHandler, -1)
+        table.set_property_handler("level", StringHandler)
+        table.set_property_handler("message", MessageHandler)
+        table.set_property_handler("locations", LocationsHandler)
+        table.set_property_handler("relatedLocations", LocationsHandler)
+        table.set_property_handler("codeFlows", CodeFlowsHandler)
+        table.set_property_handler("properties", PropertiesHandler)
+        table.set_property_handler("hostedViewerUri", StringHandler)
+        table.set_property_handler("rank", FloatHandler)
         if is_legacy_version(parser.version):
-            self.set_skip_handlers(
+            table.set_skip_handlers(
                 ["instanceGuid", "correlationGuid", "analysisTarget", "fingerprints",
                 "partialFingerprints", "graphs", "graphTraversals", "stacks", "suppressionStates",
                 "baselineState", "attachments", "workItemUris", "resultProvenance",
                 "conversionProvenance", "fixes", "occurrenceCount"]
             )
         else:
-            self.set_skip_handlers(
+            table.set_skip_handlers(
                 ["kind", "analysisTarget", "guid", "correlationGuid", "occurrenceCount", "partialFingerprints",
                  "fingerprints", "stacks", "graphs", "graphTraversals", "suppressions", "baselineState",
                  "attachments", "workItemUris", "provenance", "fixes", "taxa",
                  "webRequest", "webResponse"]
             )
-
+    def initialize(self, parser):
+        self.messageId = None
+        self.locations = []
+        self.relatedLocations = []
+        self.codeFlows = []
 
     def object_member_end(self, parser, key):
         if key == "message":
@@ -561,148 +720,192 @@ class ResultHandler(Handler):
             self.properties = parser.estack[-1].value
         else:
             super(ResultHandler, self).object_member_end(parser, key)
+    def record(self):
+        return Result(self.ruleId, self.ruleIndex, self.level, self.message, self.messageId,
+                      tuple(self.locations), tuple(self.relatedLocations), tuple(self.codeFlows),
+                      self.properties, self.hostedViewerUri, self.rank)
 
 class CodeFlowsHandler(Handler):
+    __slots__ = ('codeFlows',)
     def array_start(self, parser):
         self.codeFlows = []
         return CodeFlowsItemHandler(parser)
 
 class CodeFlowsItemHandler(Handler):
+    __slots__ = ()
     def array_element_start(self, parser, idx):
         return CodeFlowHandler(parser)
     def array_element_end(self, parser, idx):
-        parser.estack[-3].codeFlows.append(parser.estack[-1])
+        parser.estack[-3].codeFlows.append(parser.estack[-1].record())
 
 class CodeFlowHandler(Handler):
+    __slots__ = ('message', 'threadFlows')
+    @classmethod
+    def declare(cls, table, parser):
+        super(CodeFlowHandler, cls).declare(table, parser)
+        table.set_property_handler("message", MessageHandler)
+        table.set_property_handler("threadFlows", ThreadFlowsHandler)
     def initialize(self, parser):
         self.threadFlows = []
-        self.set_property_handler("message", MessageHandler)
-        self.set_property_handler("threadFlows", ThreadFlowsHandler)
     def object_member_end(self, parser, key):
         if key == "threadFlows":
             self.threadFlows = parser.estack[-1].threadFlows
         else:
             super(CodeFlowHandler, self).object_member_end(parser, key)
+    def record(self):
+        return CodeFlow(self.message, tuple(self.threadFlows))
 
 class ThreadFlowsHandler(Handler):
+    __slots__ = ('threadFlows',)
     def array_start(self, parser):
         self.threadFlows = []
         return ThreadFlowsItemHandler(parser)
 
 class ThreadFlowsItemHandler(Handler):
+    __slots__ = ()
     def array_element_start(self, parser, idx):
         return ThreadFlowHandler(parser)
     def array_element_end(self, parser, idx):
-        parser.estack[-3].threadFlows.append(parser.estack[-1])
+        parser.estack[-3].threadFlows.append(parser.estack[-1].record())
 
 class ThreadFlowHandler(Handler):
+    __slots__ = ('id', 'message', 'locations')
+    @classmethod
+    def declare(cls, table, parser):
+        super(ThreadFlowHandler, cls).declare(table, parser)
+        table.set_property_handler("id", StringHandler)
+        table.set_property_handler("message", MessageHandler)
+        table.set_property_handler("locations", ThreadFlowLocationsHandler)
     def initialize(self, parser):
         self.locations = []
-        self.set_property_handler("id", StringHandler)
-        self.set_property_handler("message", MessageHandler)
-        self.set_property_handler("locations", ThreadFlowLocationsHandler)
     def object_member_end(self, parser, key):
         if key == "locations":
             self.locations = parser.estack[-1].locations
         else:
             super(ThreadFlowHandler, self).object_member_end(parser, key)
+    def record(self):
+        return ThreadFlow(self.id, self.message, tuple(self.locations))
 
 class ThreadFlowLocationsHandler(Handler):
+    __slots__ = ('locations',)
     def array_start(self, parser):
         self.locations = []
         return ThreadFlowLocationsItemHandler(parser)
 
 class ThreadFlowLocationsItemHandler(Handler):
+    __slots__ = ()
     def array_element_start(self, parser, idx):
         return ThreadFlowLocationHandler(parser)
     def array_element_end(self, parser, idx):
-        parser.estack[-3].locations.append(parser.estack[-1])
+        parser.estack[-3].locations.append(parser.estack[-1].record())
 
 class ThreadFlowLocationHandler(Handler):
-    def initialize(self, parser):
-        self.location = None
-        self.set_property_handler("location", LocationHandler)
-        self.set_property_handler("importance", StringHandler)
+    __slots__ = ('location', 'importance')
+    @classmethod
+    def declare(cls, table, parser):
+        super(ThreadFlowLocationHandler, cls).declare(table, parser)
+        table.set_property_handler("location", LocationHandler)
+        table.set_property_handler("importance", StringHandler)
         if is_legacy_version(parser.version):
-            self.set_skip_handlers(["kind"])
-        self.set_skip_handlers(
+            table.set_skip_handlers(["kind"])
+        table.set_skip_handlers(
             ["module", "stack", "kinds", "state", "nestingLevel",
              "executionOrder", "executionTimeUtc"]
         )
     def object_member_end(self, parser, key):
         if key == "location":
-            self.location = parser.estack[-1]
+            self.location = parser.estack[-1].record()
         else:
             super(ThreadFlowLocationHandler, self).object_member_end(parser, key)
+    def record(self):
+        return ThreadFlowLocation(self.location, self.importance)
 
 class LocationsHandler(Handler):
+    __slots__ = ('locations',)
     def array_start(self, parser):
         self.locations = []
         return LocationsItemHandler(parser)
 
 class LocationsItemHandler(Handler):
+    __slots__ = ()
     def array_element_start(self, parser, idx):
         return LocationHandler(parser)
     def array_element_end(self, parser, idx):
-        parser.estack[-3].locations.append(parser.estack[-1])
+        parser.estack[-3].locations.append(parser.estack[-1].record())
 
 class LocationHandler(Handler):
-    def initialize(self, parser):
-        self.physicalLocation = None
-        self.properties = {}
-        self.set_property_handler("physicalLocation", PhysicalLocationHandler)
-        self.set_property_handler("message", MessageHandler)
+    __slots__ = ('physicalLocation', 'message', 'id', 'properties')
+    @classmethod
+    def declare(cls, table, parser):
+        super(LocationHandler, cls).declare(table, parser)
+        table.set_property_handler("physicalLocation", PhysicalLocationHandler)
+        table.set_property_handler("message", MessageHandler)
         if is_legacy_version(parser.version):
-            self.set_skip_handlers(["fullyQualifiedLogicalName", "logicalLocationIndex", "annotations"])
+            table.set_skip_handlers(["fullyQualifiedLogicalName", "logicalLocationIndex", "annotations"])
         else:
-            self.set_property_handler("id", IntegerHandler)
-            self.set_skip_handlers(["logicalLocations", "relationships", "annotations"])
-        self.set_property_handler("properties", PropertiesHandler)
+            table.set_property_handler("id", IntegerHandler)
+            table.set_skip_handlers(["logicalLocations", "relationships", "annotations"])
+        table.set_property_handler("properties", PropertiesHandler)
+    def initialize(self, parser):
+        # Only the latest version has location ids
+        self.id = None
     def object_member_end(self, parser, key):
         if key == "physicalLocation":
-            self.physicalLocation = parser.estack[-1]
+            self.physicalLocation = parser.estack[-1].record()
         else:
             super(LocationHandler, self).object_member_end(parser, key)
+    def record(self):
+        return Location(self.physicalLocation, self.message, self.id, self.properties)
 
 class PhysicalLocationHandler(Handler):
-    def initialize(self, parser):
+    __slots__ = ('fileLocation', 'artifactLocation', 'contextRegion', 'region')
+    @classmethod
+    def declare(cls, table, parser):
+        super(PhysicalLocationHandler, cls).declare(table, parser)
         if is_legacy_version(parser.version):
-            self.set_property_handler("fileLocation", FileLocationHandler)
+            table.set_property_handler("fileLocation", FileLocationHandler)
         else:
-            self.set_property_handler("artifactLocation", ArtifactLocationHandler)
-            self.set_skip_handlers(["address"])
-            self.set_property_handler("contextRegion", RegionHandler)
-        self.set_property_handler("region", RegionHandler)
-        self.set_skip_handlers(["id"])
-        self.region = None
+            table.set_property_handler("artifactLocation", ArtifactLocationHandler)
+            table.set_skip_handlers(["address"])
+            table.set_property_handler("contextRegion", RegionHandler)
+        table.set_property_handler("region", RegionHandler)
+        table.set_skip_handlers(["id"])
+    def initialize(self, parser):
         self.fileLocation = None
     def object_member_end(self, parser, key):
         if (is_legacy_version(parser.version) and key == "fileLocation" or 
             is_latest_version(parser.version) and key == "artifactLocation"):
-            self.fileLocation = parser.estack[-1]
+            self.fileLocation = parser.estack[-1].record()
         elif key == "region":
-            self.region = parser.estack[-1]
+            self.region = parser.estack[-1].record()
         else:
             super(PhysicalLocationHandler, self).object_member_end(parser, key)
+    def record(self):
+        return PhysicalLocation(self.fileLocation, self.region)
 
 class RegionHandler(Handler):
     # These are all the fields that are integer typed.
     int_fields = ['startLine', 'startColumn', 'endLine', 'endColumn',
                   'charOffset', 'charLength', 'byteOffset', 'byteLength']
-    def initialize(self, parser):
+    __slots__ = tuple(int_fields) + ('message',)
+    @classmethod
+    def declare(cls, table, parser):
+        super(RegionHandler, cls).declare(table, parser)
         # A bit of metaprogramming on field names reduces risk of CPEs
         for fld_name in RegionHandler.int_fields:
-            self.__dict__[fld_name] = None
-            self.set_property_handler(fld_name, IntegerHandler)
-        self.message = None
-        self.set_property_handler("message", MessageHandler)
-        self.set_property_handler("snippet", SkipHandler)
+            table.set_property_handler(fld_name, IntegerHandler)
+        table.set_property_handler("message", MessageHandler)
+        table.set_property_handler("snippet", SkipHandler)
     def object_member_end(self, parser, key):
         for fld_name in RegionHandler.int_fields:
             if key == fld_name:
-                self.__dict__[fld_name] = parser.estack[-1].value
+                setattr(self, fld_name, parser.estack[-1].value)
         if key == "message":
             self.message = parser.estack[-1].value
+    def record(self):
+        return Region(self.startLine, self.startColumn, self.endLine, self.endColumn,
+                      self.charOffset, self.charLength, self.byteOffset, self.byteLength,
+                      self.message)
 
 class FilesHandler(Handler):
     def array_start(self, parser):
@@ -715,17 +918,20 @@ class FilesItemHandler(Handler):
         parser.state.file_item_add(parser.estack[-1])
 
 class FileHandler(Handler):
-    def initialize(self, parser):
-        self.uri = None
-        self.uriBaseId = None
-        self.set_property_handler("fileLocation", FileLocationHandler)
-        self.set_property_handler("mimeType", StringHandler)
-        self.set_property_handler("parentIndex", IntegerHandler)
-        self.set_skip_handlers(
+    @classmethod
+    def declare(cls, table, parser):
+        super(FileHandler, cls).declare(table, parser)
+        table.set_property_handler("fileLocation", FileLocationHandler)
+        table.set_property_handler("mimeType", StringHandler)
+        table.set_property_handler("parentIndex", IntegerHandler)
+        table.set_skip_handlers(
             ["offset", "length", "roles",
              "contents", "encoding", "hashes",
              "lastModifiedTimeUtc"]
         )
+    def initialize(self, parser):
+        self.uri = None
+        self.uriBaseId = None
     def object_member_end(self, parser, key):
         if key == "fileLocation":
             self.uri = parser.estack[-1].uri
@@ -734,31 +940,39 @@ class FileHandler(Handler):
             super(FileHandler, self).object_member_end(parser, key)
 
 class FileLocationHandler(Handler):
-    def initialize(self, parser):
-        self.set_property_handler("uri", StringHandler)
-        self.set_property_handler("uriBaseId", StringHandler)
-        self.set_property_handler("fileIndex", IntegerHandler, -1)
+    __slots__ = ('uri', 'uriBaseId', 'fileIndex')
+    @classmethod
+    def declare(cls, table, parser):
+        super(FileLocationHandler, cls).declare(table, parser)
+        table.set_property_handler("uri", StringHandler)
+        table.set_property_handler("uriBaseId", StringHandler)
+        table.set_property_handler("fileIndex", IntegerHandler, -1)
     def object_member_end(self, parser, key):
         if key == "uri":
             self.uri = gtr.urldecode(parser.estack[-1].value)
         else:
             super(FileLocationHandler, self).object_member_end(parser, key)
+    def record(self):
+        return FileLocation(self.uri, self.uriBaseId, self.fileIndex)
 
 ##########################################################################################
 # ANY PASS classes
 class StringHandler(Handler):
+    __slots__ = ('value',)
     def initialize(self, parser):
         self.value = None
     def do_string(self, parser, value):
         self.value = value
 
 class IntegerHandler(Handler):
+    __slots__ = ('value',)
     def initialize(self, parser):
         self.value = None
     def do_integer(self, parser, value):
         self.value = value
 
 class FloatHandler(Handler):
+    __slots__ = ('value',)
     def initialize(self, parser):
         self.value = None
     def do_float(self, parser, value):
@@ -771,16 +985,20 @@ class RuleIdHandler(Handler):
         self.rule.id = value
 
 class MessageHandler(Handler):
+    __slots__ = ('value', 'id', 'text', 'messageId')
+    @classmethod
+    def declare(cls, table, parser):
+        super(MessageHandler, cls).declare(table, parser)
+        table.set_property_handler("text", StringHandler)
+        if is_legacy_version(parser.version):
+            table.set_property_handler("messageId", StringHandler)
+            table.set_skip_handlers(["richText", "richMessageId", "arguments"])
+        else:
+            table.set_property_handler("id",StringHandler)
+            table.set_skip_handlers(["markdown", "arguments"])
     def initialize(self, parser):
         self.value = None
         self.id = None
-        self.set_property_handler("text", StringHandler)
-        if is_legacy_version(parser.version):
-            self.set_property_handler("messageId", StringHandler)
-            self.set_skip_handlers(["richText", "richMessageId", "arguments"])
-        else:
-            self.set_property_handler("id",StringHandler)
-            self.set_skip_handlers(["markdown", "arguments"])
     def object_member_end(self, parser, key):
         if key == "text":
             self.value = parser.estack[-1].value
@@ -809,49 +1027,287 @@ def get_version(sfile):
     The assumption in this code is that anything prior to 2.1.0
     is legacy. The parser will assume that the happy path is 2.1.0,
     and that anything labeled as 2.0.0 is the same schema.
+
+    A compressed file is decompressed as a stream (see sarif_input).
     '''
-    vstr = None
+    compression = sarif_input.get_compression(sfile)
+    if compression is None:
+        with sarif_input.map_sarif(sfile) as data:
+            return get_mapped_version(data)
+    with closing(sarif_input.open_compressed(sfile, compression)) as fp:
+        vstr = sniff_version(fp.read(SNIFF_SIZE))
+    if vstr is None:
+        # Not at the head of the file, so fall back to parsing it.
+        with closing(sarif_input.open_compressed(sfile, compression)) as fp:
+            vstr = parse_version(fp)
+    return split_version(vstr)
+
+def get_mapped_version(data):
+    '''get_version of the file whose contents are data'''
+    vstr = sniff_version(data)
+    if vstr is None:
+        # Not at the head of the file, so fall back to parsing it.
+        vstr = parse_version(sarif_input.MappedFile(data))
+    return split_version(vstr)
+
+def parse_version(fp):
+    '''Return the version string of the file fp by parsing it'''
     try:
         parser = SarifVersionExtractor()
-        with open(sfile) as fp:
-            gtr.json_stream_parse_all(fp, parser)
+        parse_json(gtr.json_stream_parse_all, fp, parser)
     except SarifVersionDone:
+        return parser.version
+    return None
+
+def split_version(vstr):
+    '''Return (vstr, the three numbers at the start of vstr or None)'''
+    if vstr is not None:
         # This regexp must be capable of recognizing strings that have additional
         # version information after the three digits. E.g., "2.0.0-csd-Beta3".
         # The final version won't have these, but we won't always have that.
         VRE = re.compile('^([0-9]+).([0-9]+)\.([0-9]+)')
-        vstr = parser.version
         m = VRE.match(vstr)
         if m is not None:
             return (vstr, (int(m.group(1)), int(m.group(2)), int(m.group(3))))
     return (vstr, None)
 
+# The version is recommended to come early, so it is nearly always found
+# within this many bytes of the start of the file.
+SNIFF_SIZE = 65536
+sniffTokenRe = re.compile(r'"(?:[^"\\]|\\.)*"\s*(:)?|[][{}]')
+
+def sniff_version(data, size=SNIFF_SIZE):
+    '''Look for the top-level "version" property in the head of data, the
+    contents of the file
+
+    Returns the version string, or None if it is not within the first
+    size bytes.
+    '''
+    depth = 0
+    version_seen = False
+    for m in sniffTokenRe.finditer(data, 0, size):
+        token = m.group(0)
+        if version_seen:
+            # Only a string value is a version string.
+            if token[0] != '"' or m.group(1) is not None:
+                return None
+            return json.loads(token)
+        if token in ('{', '['):
+            depth += 1
+        elif token in ('}', ']'):
+            depth -= 1
+        elif depth == 1 and m.group(1) is not None:
+            version_seen = json.loads(token[:m.start(1) - m.start(0)]) == "version"
+    return None
+
 def is_legacy_version(version):
     return version == (2,0,0)
 
 def is_latest_version(version):
     return version == (2,1,0)
 
-def process_sarif(sfile, state):
+def process_sarif(sfile, state, single_pass=False, backend=None, jobs=1, use_index=False):
     '''Import a single sarif file, given the parser state given by 'state'
 
     Sarif files original directory must be known if they 
     are to be interpreted correctly.
 
+    If single_pass is True, the file is read once and the state is driven
+    with ppass set to SINGLE_PASS. Results that precede the tables of their
+    run are buffered until the tables are complete.
+
+    backend names the JSON parser to use (see json_backends); by default
+    the fastest one available is used.
+
+    If jobs is more than 1, the file is parsed by that many worker
+    processes. If it has more than one run, each run is parsed separately,
+    in both passes or in a single pass. Otherwise, unless single_pass is True, pass 2 is
+    replaced by the parse of shards of the results array. Either way the
+    state must support shards (see SarifState).
+
+    If use_index is True, the byte offsets of the runs and their parts are
+    kept in a sidecar (see sarif_index), or taken from it if it is up to
+    date. Pass 1 then reads only the tables of the runs, and pass 2 only
+    their results. This is done instead of the single pass, too.
+
+    The file is memory-mapped (see sarif_input), so every pass, and every
+    worker, reads it from the page cache. A compressed file cannot be
+    mapped, so it is decompressed as a stream for each pass instead, in
+    this process and without an index.
+
     Returns void, and may raise SarifImporterException() on failure.
     '''
+    compression = sarif_input.get_compression(sfile)
+    if compression is not None:
+        process_compressed_sarif(sfile, compression, state, single_pass, backend, jobs, use_index)
+        return
+    with sarif_input.map_sarif(sfile) as data:
+        process_mapped_sarif(sfile, data, state, single_pass, backend, jobs, use_index)
+
+def process_compressed_sarif(sfile, compression, state, single_pass, backend, jobs, use_index):
+    '''process_sarif of sfile, which is compressed with compression'''
     (vstr, version) = get_version(sfile)
     if version is None:
         raise SarifImporterException("Cannot extract SARIF version number from version string '{}' in Sarif file '{}'".format(vstr, sfile))
 
-    state.set_ppass(1)
-    pass1_parser = SarifParser(version, state)
-    state.set_parser(pass1_parser)
-    with open(sfile) as fp:
-        gtr.json_stream_parse_all(fp, pass1_parser)
+    json_stream_parse_all = json_backends.get_backend(backend)
+    if jobs > 1 or use_index:
+        # The offsets of an index are of the decompressed bytes, which
+        # cannot be read other than in order.
+        print("*** {0} is compressed with {1}, so it is parsed without an index in one process".format(sfile, compression))
+    for ppass in ([SINGLE_PASS] if single_pass else [1, 2]):
+        with closing(sarif_input.open_compressed(sfile, compression)) as fp:
+            parse_stream(fp, state, version, ppass, json_stream_parse_all)
+
+def process_mapped_sarif(sfile, data, state, single_pass, backend, jobs, use_index):
+    '''process_sarif of sfile, whose contents are data'''
+    (vstr, version) = get_mapped_version(data)
+    if version is None:
+        raise SarifImporterException("Cannot extract SARIF version number from version string '{}' in Sarif file '{}'".format(vstr, sfile))
 
+    json_stream_parse_all = json_backends.get_backend(backend)
+    runs = None
+    if jobs > 1 or use_index:
+        runs = sarif_index.get_index(sfile, data, use_index)
+    if runs is not None and jobs > 1 and len(runs) > 1:
+        parse_runs_separately(sfile, state, version, single_pass, json_stream_parse_all, jobs, runs)
+    elif runs is not None and (use_index or not single_pass):
+        # Without an index, a single pass is taken rather than shards
+        parse_tables(data, state, version, json_stream_parse_all, runs)
+        if jobs > 1:
+            parse_results_in_shards(sfile, state, version, json_stream_parse_all, jobs, runs)
+        else:
+            parse_results(data, state, version, json_stream_parse_all, runs)
+    elif single_pass:
+        parse_pass(data, state, version, SINGLE_PASS, json_stream_parse_all)
+    else:
+        parse_pass(data, state, version, 1, json_stream_parse_all)
+        parse_pass(data, state, version, 2, json_stream_parse_all)
+
+def parse_pass(data, state, version, ppass, json_stream_parse_all):
+    parse_stream(sarif_input.MappedFile(data), state, version, ppass, json_stream_parse_all)
+
+def parse_json(json_stream_parse_all, fp, parser):
+    '''Drive parser from the JSON document in fp, reporting malformed JSON
+    as a SarifImporterException'''
+    try:
+        return json_stream_parse_all(fp, parser)
+    except json_backends.JSON_ERRORS, e:
+        raise SarifImporterException("Malformed JSON: {0}".format(e))
+
+def parse_stream(fp, state, version, ppass, json_stream_parse_all):
+    state.set_ppass(ppass)
+    parser = SarifParser(version, state)
+    state.set_parser(parser)
+    stream = parse_json(json_stream_parse_all, fp, parser)
+    # Not every backend reports how much of the file was skipped.
+    if stream is not None:
+        print("*** {0} skipped {1} bytes".format(pass_description(ppass), stream.bytes_skipped))
+
+def parse_tables(data, state, version, json_stream_parse_all, runs):
+    '''Do pass 1 over just the sections of runs, from the index of data,
+    that hold their tables'''
+    pieces = ['{"runs": [']
+    for i, run in enumerate(runs):
+        pieces.append('{' if i == 0 else ', {')
+        sections = sorted((span, key) for key, span in run.sections.items()
+                          if key in sarif_index.SECTIONS)
+        for j, (span, key) in enumerate(sections):
+            pieces.append('%s"%s": ' % ('' if j == 0 else ', ', key))
+            pieces.append(span)
+        pieces.append('}')
+    pieces.append(']}')
+    parse_stream(sarif_index.SpanReader(data, pieces), state, version, 1, json_stream_parse_all)
+
+def parse_results(data, state, version, json_stream_parse_all, runs):
+    '''Do pass 2 over just the results of runs, from the index of data'''
+    pieces = ['{"runs": [']
+    for i, run in enumerate(runs):
+        pieces.append('{' if i == 0 else ', {')
+        if run.results:
+            pieces.append('"results": [')
+            pieces.append((run.results[0][0], run.results[-1][1]))
+            pieces.append(']')
+        pieces.append('}')
+    pieces.append(']}')
+    parse_stream(sarif_index.SpanReader(data, pieces), state, version, 2, json_stream_parse_all)
+
+# Each worker parses this many shards on average, so that the workers
+# finish at about the same time even if some shards are slower.
+SHARDS_PER_JOB = 4
+
+def parse_runs_separately(sfile, state, version, single_pass, json_stream_parse_all, jobs, runs):
+    '''Parse each of runs, from the index of sfile, as a SARIF file of its
+    own in a pool of worker processes, each of which gets a copy of state
+    as it was before the parse. The output of the runs is merged into state
+    in the order of the file.'''
+    print("*** Parsing {0} runs separately".format(len(runs)))
+    outputs = map_in_workers(parse_run_in_worker, [(r.start, r.end) for r in runs], jobs,
+                             (sfile, state, version, json_stream_parse_all, single_pass))
+    for output in outputs:
+        state.merge_shard(output)
+
+def parse_results_in_shards(sfile, state, version, json_stream_parse_all, jobs, runs):
+    '''Do the work of pass 2 by parsing shards of the results of each of
+    runs, from the index of sfile, in a pool of worker processes, each of
+    which gets a copy of the state as it was after pass 1. The output of
+    the shards is merged into state in the order of the file.'''
+    shards = sarif_index.make_shards(runs, jobs * SHARDS_PER_JOB)
+    print("*** Parser pass 2 is parsing {0} results of {1} runs in {2} shards".format(
+        sum(len(r.results) for r in runs), len(runs), len(shards)))
+    outputs = map_in_workers(parse_shard_in_worker, shards, jobs,
+                             (sfile, state, version, json_stream_parse_all, False))
+    for output in outputs:
+        state.merge_shard(output)
+
+def map_in_workers(worker, items, jobs, args, initializer=None):
+    '''Return the list of worker(item) for each of items, computed by a pool
+    of up to jobs processes, which get args through initializer, by default
+    init_worker. An exception raised by worker is raised again here, after
+    the pool is terminated.'''
+    if not items:
+        return []
+    pool = multiprocessing.Pool(min(jobs, len(items)), initializer or init_worker, args)
+    try:
+        outputs = pool.map(worker, items, 1)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return outputs
+
+# The arguments shared by the items of map_in_workers in a worker
+# process: (sfile, state, version, json_stream_parse_all, single_pass)
+worker_args = None
+
+def init_worker(*args):
+    global worker_args
+    worker_args = args
+
+def parse_run_in_worker(span):
+    sfile, state, version, json_stream_parse_all, single_pass = worker_args
+    state.start_shard(None)
+    # Mapping the file again shares the pages of the parent's map
+    with sarif_input.map_sarif(sfile) as data:
+        # The run is parsed as the only run of a file
+        for ppass in ([SINGLE_PASS] if single_pass else [1, 2]):
+            reader = sarif_index.SpanReader(data, ['{"runs": [', span, ']}'])
+            parse_stream(reader, state, version, ppass, json_stream_parse_all)
+    return state.end_shard()
+
+def parse_shard_in_worker(shard):
+    sfile, state, version, json_stream_parse_all, single_pass = worker_args
+    run_index, start, end = shard
+    state.start_shard(run_index)
+    with sarif_input.map_sarif(sfile) as data:
+        parse_results_shard(data, state, version, start, end, json_stream_parse_all)
+    return state.end_shard()
+
+def parse_results_shard(data, state, version, start, end, json_stream_parse_all):
+    '''Report the results in bytes start to end of data, which are a
+    whole number of elements of a results array, as pass 2 would'''
     state.set_ppass(2)
-    pass2_parser = SarifParser(version, state)
-    state.set_parser(pass2_parser)
-    with open(sfile) as fp:
-        gtr.json_stream_parse_all(fp, pass2_parser)
+    parser = SarifParser(version, state)
+    state.set_parser(parser)
+    parser.estack = [ResultsHandler(parser)]
+    parse_json(json_stream_parse_all, sarif_index.SpanReader(data, ['[', (start, end), ']']), parser)
@@ -41,9 +41,35 @@ class SarifState(object):
     def run_object_start(self, parser):
         raise NotImplementedError("run_object_start")
 
-    def results_item_array_element_end(self, parser, idx):
+    # Optional: the end of a run, and (in the single pass only) the point at
+    # which all of the tables of the run have been read.
+    def run_object_end(self, parser):
+        pass
+
+    def run_tables_complete(self, parser):
+        pass
+
+    # result is the sarif_parser.Result record of the completed result.
+    def results_item_array_element_end(self, parser, idx, result):
         raise NotImplementedError("results_item_array_element_end")
 
     def file_item_add(self, file_item):
         raise NotImplementedError("file_item_add")
+
+    # Optional: the support for parsing a file in shards, each in a copy
+    # of the state. A shard is either a run, parsed from a copy of the
+    # state before the parse, or part of the results of a run, parsed from
+    # a copy of the state after pass 1. A copy may parse several shards.
+    # start_shard begins a shard; its run_index is None for a run, and
+    # otherwise selects the tables of run run_index (counting from 0).
+    # end_shard returns what the shard produced, which must be picklable,
+    # and merge_shard adds that to this state.
+    def start_shard(self, run_index):
+        raise NotImplementedError("start_shard")
+
+    def end_shard(self):
+        raise NotImplementedError("end_shard")
+
+    def merge_shard(self, output):
+        raise NotImplementedError("merge_shard")
  
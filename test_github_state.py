@@ -23,10 +23,15 @@ def import_inputs(args, default_dir):
         try:
             print("****** Importing '{0}' *******".format(f))
             # Each imported file gets its own CodeSonar state
-            state = github_sarif_state.GithubSarifState()
-            sarif_parser.process_sarif(f, state)
+            path_filter = None
+            if args.paths:
+                path_filter = set(args.paths).__contains__
+            state = github_sarif_state.GithubSarifState(path_filter)
+            sarif_parser.process_sarif(f, state, args.single_pass, args.json_backend, args.jobs, args.index)
             for comment in state.comments:
                 print("Comment %s" % repr(comment))
+            if args.paths:
+                print("*** {0} results were not in the given paths".format(state.filtered_results))
             nimports += 1
         except sarif_parser.SarifImporterException as e:
             print("Failed to import '{}': {}".format(f, e))
@@ -69,6 +74,17 @@ def mock_cso_import():
     parser.add_argument('-b', '--baseline-directory', default='baselines',
                         help="The directory in which to find the baseline results")
 
+    parser.add_argument('-1', '--single-pass', action='store_true',
+                        help="Import each file in a single pass")
+    parser.add_argument('--json-backend', default='auto',
+                        dest='json_backend',
+                        help="The JSON parser to use: auto, ijson or gtr")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="Parse the results of each file in shards with this many processes")
+    parser.add_argument('--index', action='store_true',
+                        help="Keep the byte offsets of the parts of each file in a sidecar file, and use them")
+    parser.add_argument('--path', action='append', dest='paths',
+                        help="Only make comments for results in this file, as named in the SARIF file (may be repeated)")
     args = parser.parse_args()
 
     return_code = import_inputs(args, '.')
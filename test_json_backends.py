@@ -0,0 +1,74 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+import tinygtr
+import json_backends
+import sarif_parser
+import github_sarif_state
+
+# Two results, and values the parser skips around them
+SARIF = {
+    "version": "2.1.0",
+    "runs": [{
+        "tool": {"driver": {"name": "Tool", "rules": [{"id": "R1"}]}},
+        "invocations": [{"toolExecutionNotifications": [{"message": {"text": "ignored"}}]}],
+        "results": [
+            {"ruleId": "R1", "ruleIndex": 0, "message": {"text": "first"},
+             "suppressions": [{"kind": "external"}],
+             "locations": [{"physicalLocation": {"artifactLocation": {"uri": "a.c"}, "region": {"startLine": 3}}}]},
+            {"ruleId": "R1", "ruleIndex": 0, "message": {"text": "second"},
+             "locations": [{"physicalLocation": {"artifactLocation": {"uri": "b.c"}, "region": {"startLine": 5}}}]},
+            ],
+        }],
+    }
+
+def import_comments(sfile, backend):
+    state = github_sarif_state.GithubSarifState()
+    sarif_parser.process_sarif(sfile, state, backend=backend)
+    return [(c.path, c.line, c.body) for c in state.comments]
+
+class GtrWithoutSkipValueTest(unittest.TestCase):
+    '''A gtr that cannot skip values must not make the ijson backend skip
+    everything'''
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.sfile = os.path.join(self.tmpdir, 'test.sarif')
+        with open(self.sfile, 'w') as fp:
+            json.dump(SARIF, fp)
+        gtr = types.ModuleType('gtr')
+        gtr.__dict__.update((name, value) for name, value in vars(tinygtr).items()
+                            if name != 'SKIP_VALUE' and not name.startswith('__'))
+        self.saved_gtr = sys.modules.get('gtr')
+        sys.modules['gtr'] = gtr
+        reload(json_backends)
+        reload(sarif_parser)
+
+    def tearDown(self):
+        if self.saved_gtr is None:
+            del sys.modules['gtr']
+        else:
+            sys.modules['gtr'] = self.saved_gtr
+        reload(json_backends)
+        reload(sarif_parser)
+        shutil.rmtree(self.tmpdir)
+
+    def test_skip_value_is_private(self):
+        self.assertIsNotNone(json_backends.SKIP_VALUE)
+        self.assertIs(sarif_parser.SKIP_VALUE, json_backends.SKIP_VALUE)
+
+    def test_gtr_backend(self):
+        self.assertEqual(import_comments(self.sfile, 'gtr'),
+                         [(u'a.c', 3, u'first'), (u'b.c', 5, u'second')])
+
+    @unittest.skipIf(json_backends.ijson_yajl2_c is None, 'ijson is not installed')
+    def test_ijson_backend(self):
+        self.assertEqual(import_comments(self.sfile, 'ijson'),
+                         import_comments(self.sfile, 'gtr'))
+
+if __name__ == '__main__':
+    unittest.main()
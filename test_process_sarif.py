@@ -0,0 +1,69 @@
+import json
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+
+import sarif_parser
+import github_sarif_state
+
+# If a worker's exception cannot be sent back, the pool never returns. A
+# Python handler would not run while the pool waits, so the alarm is left
+# to kill the process instead.
+TIMEOUT = 60
+
+def make_run(tool, lines):
+    return {
+        "tool": {"driver": {"name": tool, "rules": [{"id": "R1"}]}},
+        "results": [
+            {"ruleId": "R1", "ruleIndex": 0, "message": {"text": "result %d" % i},
+             "locations": [{"physicalLocation": {"artifactLocation": {"uri": "a.c"},
+                                                 "region": {"startLine": line}}}]}
+            for i, line in enumerate(lines)],
+        }
+
+class ProcessSarifTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        signal.alarm(TIMEOUT)
+
+    def tearDown(self):
+        signal.alarm(0)
+        shutil.rmtree(self.tmpdir)
+
+    def write_sarif(self, runs):
+        sfile = os.path.join(self.tmpdir, 'test.sarif')
+        with open(sfile, 'w') as fp:
+            json.dump({"version": "2.1.0", "runs": runs}, fp)
+        return sfile
+
+    def import_comments(self, sfile, single_pass=False, jobs=1):
+        state = github_sarif_state.GithubSarifState()
+        sarif_parser.process_sarif(sfile, state, single_pass, jobs=jobs)
+        return [(c.line, c.body) for c in state.comments]
+
+    def test_malformed_run_in_worker(self):
+        # A region whose startLine is an object
+        sfile = self.write_sarif([make_run("A", [1, 2]), make_run("B", [3, {"x": 1}])])
+        for jobs in (1, 2):
+            self.assertRaises(sarif_parser.SarifImporterException, self.import_comments, sfile, jobs=jobs)
+
+    def test_malformed_shard_in_worker(self):
+        sfile = self.write_sarif([make_run("A", [1, 2, 3, 4, 5, 6, 7, {"x": 1}])])
+        self.assertRaises(sarif_parser.SarifImporterException, self.import_comments, sfile, jobs=2)
+
+    def test_single_pass_is_not_sharded(self):
+        sfile = self.write_sarif([make_run("A", [1, 2, 3, 4, 5, 6, 7, 8])])
+        expected = self.import_comments(sfile, single_pass=True)
+        def parse_results_in_shards(*args):
+            self.fail('a single pass was parsed in shards')
+        saved = sarif_parser.parse_results_in_shards
+        sarif_parser.parse_results_in_shards = parse_results_in_shards
+        try:
+            self.assertEqual(self.import_comments(sfile, single_pass=True, jobs=2), expected)
+        finally:
+            sarif_parser.parse_results_in_shards = saved
+
+if __name__ == '__main__':
+    unittest.main()
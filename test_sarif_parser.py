@@ -22,7 +22,7 @@ def import_inputs(args, default_dir, use_stdout=True):
             print("****** Importing '{0}' *******".format(f))
             # Each imported file gets its own CodeSonar state
             cso = plain_sarif_state.PlainSarifState()
-            sarif_parser.process_sarif(f, cso)
+            sarif_parser.process_sarif(f, cso, args.single_pass, args.json_backend)
             nimports += 1
             #comments.extend(cso.comments)
         except sarif_parser.SarifImporterException as e:
@@ -57,6 +57,12 @@ def mock_cso_import():
                         dest='inputs',
                         default=None,
                         help='The names of the SARIF files; all files with suffix ".sarif" are used otherwise')
+    parser.add_argument('-1', '--single-pass', action='store_true',
+                        dest='single_pass',
+                        help="Import each file in a single pass")
+    parser.add_argument('--json-backend', default='auto',
+                        dest='json_backend',
+                        help="The JSON parser to use: auto, ijson or gtr")
     args = parser.parse_args()
 
     return_code = import_inputs(args, '.')
@@ -2,6 +2,7 @@
 import re
 import urllib
 import json
+import jsonstream
 
 def parse_data(src, parser):
     if isinstance(src, dict):
@@ -40,9 +41,15 @@ def parse_data(src, parser):
         # need more values here...
         print "Value %s"%src
 
+# Returned from a parser callback to skip the value that follows it.
+SKIP_VALUE = jsonstream.SKIP_VALUE
+
 def json_stream_parse_all(fobj, parser):
-    data = json.load(fobj)
-    parse_data(data, parser)
+    '''Parse fobj, returning the stream so that its statistics
+    (e.g. bytes_skipped) can be examined.'''
+    stream = jsonstream.JsonEventStream(fobj)
+    stream.parse(parser)
+    return stream
 
 def xmlencode(src):
     src = src.replace("&", "&amp;")
@@ -0,0 +1,277 @@
+# open-source version of the gtr incremental JSON parser
+#
+# The input is read in fixed-size chunks and the callbacks of an
+# AbstractJsonParser are called as each token is recognized, so memory use
+# is bounded by the nesting depth and the largest single token rather than
+# by the size of the file. If the input is already in memory, e.g. a
+# memory map, it is scanned in place instead, and only the strings and
+# numbers that are passed to the parser are copied out of it.
+
+import re
+from json.decoder import scanstring
+
+CHUNK_SIZE = 65536
+
+wsRe = re.compile(r'[ \t\n\r]*')
+numberRe = re.compile(r'-?(?:0|[1-9][0-9]*)(\.[0-9]+)?([eE][-+]?[0-9]+)?')
+numberCharsRe = re.compile(r'[-+0-9.eE]*')
+# Used when skipping: everything up to the next bracket or string, the rest
+# of a string after its opening quote, and a scalar other than a string.
+skipToRe = re.compile(r'[^"{}\[\]]*')
+stringTailRe = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+scalarRe = re.compile(r'[^ \t\n\r,\]}]*')
+
+# Returned from object_member_start or array_element_start to have the value
+# that follows scanned for bracket balance only, without any callbacks.
+SKIP_VALUE = object()
+
+# Parser states
+VALUE = 0
+AFTER_VALUE = 1
+
+class JsonEventStream(object):
+    '''Tokenizes the JSON document in fobj, calling the methods of a parser
+    in the same order as the C implementation does.
+    '''
+    def __init__(self, fobj, chunk_size=CHUNK_SIZE):
+        self.fobj = fobj
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        # The offset in the file of self.buf[0]
+        self.base = 0
+        self.eof = False
+        self.bytes_skipped = 0
+        # A file object with a mapping attribute holds the whole document
+        # in it, as a string or anything else with the buffer interface.
+        self.mapped = getattr(fobj, 'mapping', None) is not None
+        if self.mapped:
+            self.buf = fobj.mapping
+            self.pos = fobj.tell()
+            self.eof = True
+
+    def tell(self):
+        return self.base + self.pos
+
+    def read_more(self, size=None):
+        '''Append at least size bytes of input to the buffer, discarding what
+        has already been consumed. Returns False at end of file.'''
+        if self.eof:
+            return False
+        data = self.fobj.read(max(size or 0, self.chunk_size))
+        if not data:
+            self.eof = True
+            return False
+        self.base += self.pos
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def ensure(self, n):
+        '''Make sure that n bytes are available, if the input has them.'''
+        while len(self.buf) - self.pos < n:
+            if not self.read_more(n):
+                return False
+        return True
+
+    def peek(self):
+        '''Skip whitespace and return the next character, or '' at EOF.'''
+        if self.pos < len(self.buf):
+            c = self.buf[self.pos]
+            if c not in ' \t\n\r':
+                return c
+        while True:
+            self.pos = wsRe.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.read_more():
+                return ''
+
+    def error(self, msg):
+        raise ValueError("{0} at offset {1}".format(msg, self.tell()))
+
+    def read_string(self):
+        '''Read the string starting at the current position.'''
+        # Find the end of the string first, so that only a string that is
+        # not all in the buffer yet makes us read more, and an error from
+        # scanstring is an error in the string itself.
+        while True:
+            m = stringTailRe.match(self.buf, self.pos + 1)
+            if m is not None:
+                break
+            # The string may continue in the next chunk. Grow the
+            # buffer geometrically so very long strings stay linear.
+            if not self.read_more(len(self.buf) - self.pos):
+                self.error("Unterminated string")
+        try:
+            if self.mapped:
+                # scanstring only takes a str, so copy out just the string
+                value = scanstring(self.buf[self.pos:m.end()], 1, 'utf-8', True)[0]
+            else:
+                value = scanstring(self.buf, self.pos + 1, 'utf-8', True)[0]
+        except ValueError, e:
+            self.error("Invalid string ({0})".format(e))
+        self.pos = m.end()
+        return value
+
+    def read_key(self):
+        if self.peek() != '"':
+            self.error("Expecting property name")
+        key = self.read_string()
+        if self.peek() != ':':
+            self.error("Expecting : delimiter")
+        self.pos += 1
+        return key
+
+    def read_number(self, parser):
+        # A number may be split across chunks
+        while numberCharsRe.match(self.buf, self.pos).end() == len(self.buf):
+            if not self.read_more():
+                break
+        m = numberRe.match(self.buf, self.pos)
+        if m is None:
+            self.error("No JSON object could be decoded")
+        self.pos = m.end()
+        if m.group(1) is None and m.group(2) is None:
+            parser.integer_value_as_string(m.group(0))
+        else:
+            parser.float_value_as_string(m.group(0))
+
+    def skip_string(self):
+        while True:
+            m = stringTailRe.match(self.buf, self.pos + 1)
+            if m is not None:
+                self.pos = m.end()
+                return
+            if not self.read_more(len(self.buf) - self.pos):
+                self.error("Unterminated string")
+
+    def skip_value(self):
+        '''Skip the value starting at the current position.'''
+        c = self.peek()
+        start = self.tell()
+        if c == '"':
+            self.skip_string()
+        elif c == '{' or c == '[':
+            depth = 0
+            while True:
+                self.pos = skipToRe.match(self.buf, self.pos).end()
+                if self.pos == len(self.buf):
+                    if not self.read_more():
+                        self.error("Unterminated value")
+                    continue
+                c = self.buf[self.pos]
+                if c == '"':
+                    self.skip_string()
+                    continue
+                self.pos += 1
+                if c == '{' or c == '[':
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        break
+        else:
+            while scalarRe.match(self.buf, self.pos).end() == len(self.buf):
+                if not self.read_more():
+                    break
+            end = scalarRe.match(self.buf, self.pos).end()
+            if end == self.pos:
+                self.error("No JSON object could be decoded")
+            self.pos = end
+        self.bytes_skipped += self.tell() - start
+
+    def read_literal(self, literal):
+        self.ensure(len(literal))
+        if self.buf[self.pos:self.pos + len(literal)] != literal:
+            self.error("No JSON object could be decoded")
+        self.pos += len(literal)
+
+    def parse(self, parser):
+        '''Parse one complete JSON document.'''
+        self.ensure(3)
+        if self.buf[self.pos:self.pos + 3] == '\xef\xbb\xbf':
+            self.pos += 3
+        # One entry per open object or array: [is_object, key or index]
+        frames = []
+        state = VALUE
+        while True:
+            c = self.peek()
+            if state == VALUE:
+                state = AFTER_VALUE
+                if c == '{':
+                    self.pos += 1
+                    parser.object_start()
+                    if self.peek() == '}':
+                        self.pos += 1
+                        parser.object_end()
+                    else:
+                        key = self.read_key()
+                        frames.append([True, key])
+                        if parser.object_member_start(key) is SKIP_VALUE:
+                            self.skip_value()
+                        else:
+                            state = VALUE
+                elif c == '[':
+                    self.pos += 1
+                    parser.array_start()
+                    if self.peek() == ']':
+                        self.pos += 1
+                        parser.array_end()
+                    else:
+                        frames.append([False, 0])
+                        if parser.array_element_start(0) is SKIP_VALUE:
+                            self.skip_value()
+                        else:
+                            state = VALUE
+                elif c == '"':
+                    parser.string_value(self.read_string())
+                elif c == 't':
+                    self.read_literal('true')
+                    parser.true_value()
+                elif c == 'f':
+                    self.read_literal('false')
+                    parser.false_value()
+                elif c == 'n':
+                    self.read_literal('null')
+                    parser.null_value()
+                elif c == '-' or c.isdigit():
+                    self.read_number(parser)
+                else:
+                    self.error("No JSON object could be decoded")
+            elif not frames:
+                if c != '':
+                    self.error("Extra data")
+                return
+            else:
+                frame = frames[-1]
+                if frame[0]:
+                    parser.object_member_end(frame[1])
+                    if c == ',':
+                        self.pos += 1
+                        frame[1] = self.read_key()
+                        if parser.object_member_start(frame[1]) is SKIP_VALUE:
+                            self.skip_value()
+                        else:
+                            state = VALUE
+                    elif c == '}':
+                        self.pos += 1
+                        frames.pop()
+                        parser.object_end()
+                    else:
+                        self.error("Expecting , delimiter")
+                else:
+                    parser.array_element_end(frame[1])
+                    if c == ',':
+                        self.pos += 1
+                        frame[1] += 1
+                        if parser.array_element_start(frame[1]) is SKIP_VALUE:
+                            self.skip_value()
+                        else:
+                            state = VALUE
+                    elif c == ']':
+                        self.pos += 1
+                        frames.pop()
+                        parser.array_end()
+                    else:
+                        self.error("Expecting , delimiter")
@@ -1,4 +1,4 @@
-import sys, bisect
+import sys, bisect, array
 
 class RangeMap(object):
     '''A map from integer ranges to values.  Uses a sparse
@@ -43,3 +43,67 @@ class RangeMap(object):
         return '%s(%r, %r)' % (type(self).__name__, self.ranges, self.posinf)
 
 
+class OffsetRangeMap(object):
+    '''A map from integer ranges to integers, in which each range maps x to
+    x plus an offset of its own.  The bounds and offsets are kept in
+    arrays rather than in a list of tuples, and a sorted sequence of keys
+    can be looked up in a single pass over the ranges.'''
+    # Ranges should be a list of disjoint (lower, upper, offset) triples in
+    # sorted order.  Upper bounds are exclusive.
+    def __init__(self, ranges, posinf=sys.maxint):
+        self.lowers = array.array('l')
+        self.uppers = array.array('l')
+        self.offsets = array.array('l')
+        self.posinf = posinf
+        last_upper = None
+        for lower, upper, offset in ranges:
+            if lower == upper:
+                continue
+            assert lower < upper
+            assert upper < posinf
+            if last_upper is not None:
+                assert lower >= last_upper
+            last_upper = upper
+            self.lowers.append(lower)
+            self.uppers.append(upper)
+            self.offsets.append(offset)
+
+    def __getitem__(self, x):
+        j = bisect.bisect(self.lowers, x)
+        if j != 0 and x < self.uppers[j - 1]:
+            return x + self.offsets[j - 1]
+        raise KeyError(x)
+
+    def __contains__(self, x):
+        j = bisect.bisect(self.lowers, x)
+        return j != 0 and x < self.uppers[j - 1]
+
+    def get(self, x, default=None):
+        j = bisect.bisect(self.lowers, x)
+        if j != 0 and x < self.uppers[j - 1]:
+            return x + self.offsets[j - 1]
+        return default
+
+    def get_many(self, xs, default=None):
+        '''Return the list of the values of xs, with default for those not
+        in the map.  This is a merge of xs with the ranges when xs is
+        sorted; a key smaller than its predecessor costs a bisect.'''
+        lowers, uppers, offsets = self.lowers, self.uppers, self.offsets
+        n = len(lowers)
+        result = []
+        j = 0
+        last = None
+        for x in xs:
+            if last is not None and x < last:
+                j = max(bisect.bisect(lowers, x) - 1, 0)
+            last = x
+            while j < n and uppers[j] <= x:
+                j += 1
+            if j < n and lowers[j] <= x:
+                result.append(x + offsets[j])
+            else:
+                result.append(default)
+        return result
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (type(self).__name__, zip(self.lowers, self.uppers, self.offsets), self.posinf)